@@ -17,13 +17,50 @@ TAB : Insert the value defined in settings.tabString at the cursor.
 \u21E7+TAB : Remove the value defined in settings.tabString before the cursor.
 ESC : Display auto-completion suggestions.
 \u2318F : Initiate a text search. (Note: replacing found text is not supported.)
+
+Results
+-------
+Long results are shortened. The limits are defined in settings.
+more() : Page through the most recently shortened result.
+show(value, all=True) : Show the complete representation of value.
+_1, _2, ... : Earlier results, by number.
+Out[1], Out[2], ... : Earlier results, including those held weakly.
+
+Asynchronous Code
+-----------------
+await can be used at the prompt. The code runs on an event loop
+that belongs to the interpreter and keeps running between
+commands, so tasks started with asyncio.ensure_future continue
+to run, and print, after the command that started them.
+
+Commands
+--------
+Lines starting with % are commands for the interpreter.
+%results : List the results in the history with their estimated sizes.
+%results clear : Empty the result history.
+%whos [pattern ...] [-r] : List names with their types and estimated sizes. -r lists what else holds each value.
+%reset [pattern ...] : Remove names and report the memory reclaimed. Without patterns, everything defined since startup is removed.
+%save_session [name] [pattern ...] : Save the picklable values defined since startup. Values that can't be saved are listed.
+%load_session [name] : Load values saved with %save_session.
+%kernel : Show the kernel this window is attached to.
+%autoreload [on|off] : Turn automatic reloading of changed modules on or off. Without an argument, the watched modules are listed.
+%sample [-n count] [-o path] [statement] : Profile statement with the sampling profiler and show the top functions. Without a statement, the next command is profiled. -o writes the samples to a speedscope (.json) or collapsed stack (any other extension) file.
+%record start [path] : Record the code executed from now on, with the time each command takes, to a JSON file. Without a path, the recording goes in the session directory. % commands are not recorded.
+%record stop : Stop recording and save the file. Replay it with "python roboREPLReplay.py recording.json" to compare the timings.
 """.strip()
 
 # This was inspired by the PyObjC Interpreter demo.
 
+import os
+import re
 import sys
+import fnmatch
+import itertools
+import time
+import threading
+import traceback
+from collections import deque
 
-from code import InteractiveConsole
 from defcon.tools.notifications import NotificationCenter
 from objc import super
 import AppKit
@@ -31,6 +68,17 @@ import vanilla
 from vanilla.vanillaTextEditor import VanillaTextEditorDelegate
 from defconAppKit.windows.baseWindow import BaseWindowController
 import plistlib
+from roboREPLDisplay import DisplayHook, LimitedRepr
+from roboREPLHistory import ResultHistory
+import roboREPLMemory
+from roboREPLProfiler import SamplingProfiler, minimumSampleInterval
+import roboREPLSession
+from roboREPLReload import ModuleReloader
+from roboREPLTranscript import TranscriptWriter
+from roboREPLHighlight import InputHighlighter
+from roboREPLSelection import findTokenRangeInTextStorage
+from roboREPLReplay import SessionRecorder
+from roboREPLAsync import AsyncConsole, newEventLoop, runEventLoopOnce, hasPendingTasks, closeEventLoop
 
 try:
     sys.ps1
@@ -83,6 +131,22 @@ defaultSettings = dict(
     fontName="Menlo-Regular",
     fontSize=20,
     showInvisibleCharacters=False,
+    tagThreadOutput=False,
+    syntaxHighlighting=True,
+    resultMaxItems=100,
+    resultMaxDepth=4,
+    resultMaxLength=10000,
+    resultHistorySize=50,
+    resultHistoryMaxBytes=256 * 1024 * 1024,
+    resultHistoryWeakThreshold=0,
+    profilerInterval=0.001,
+    autoReload=False,
+    kernelName="",
+    transcriptPath="",
+    transcriptMaxBytes=10 * 1024 * 1024,
+    transcriptBackupCount=5,
+    transcriptCompress=False,
+    sessionDirectory=os.path.join("~", "Library", "Application Support", "RoboREPL", "Sessions"),
     startupCode=defaultStartupCode,
     userThemes={}
 )
@@ -92,19 +156,31 @@ defaultThemes = dict(
         colorCode=(0, 0, 0, 1),
         colorStderr=(1, 0, 0, 1),
         colorStdout=(0, 0, 1, 1),
-        colorBackground=(1, 1, 1, 1)
+        colorBackground=(1, 1, 1, 1),
+        colorKeyword=(0.6, 0, 0.6, 1),
+        colorString=(0, 0.5, 0, 1),
+        colorNumber=(0.6, 0.4, 0, 1),
+        colorComment=(0.5, 0.5, 0.5, 1)
     ),
     classic=dict(
         colorCode=(0, 1, 0, 1),
         colorStderr=(1, 0, 0, 1),
         colorStdout=(1, 1, 1, 1),
-        colorBackground=(0, 0, 0, 0.8)
+        colorBackground=(0, 0, 0, 0.8),
+        colorKeyword=(1, 1, 0, 1),
+        colorString=(0, 1, 1, 1),
+        colorNumber=(1, 0.5, 0, 1),
+        colorComment=(0.5, 0.5, 0.5, 1)
     ),
     robofog=dict(
         colorCode=(0, 0, 0, 1),
         colorStderr=(0, 0, 0, 1),
         colorStdout=(0, 0, 0, 1),
-        colorBackground=(1, 1, 1, 1)
+        colorBackground=(1, 1, 1, 1),
+        colorKeyword=(0, 0, 0, 1),
+        colorString=(0, 0, 0, 1),
+        colorNumber=(0, 0, 0, 1),
+        colorComment=(0, 0, 0, 1)
     )
 )
 
@@ -128,6 +204,21 @@ def settingsPositiveNumberValidator(value):
         return False
     return value >= 0
 
+def settingsPositiveIntegerValidator(value):
+    if not isinstance(value, int):
+        return False
+    return value > 0
+
+def settingsCountValidator(value):
+    if not isinstance(value, int):
+        return False
+    return value >= 0
+
+def settingsProfilerIntervalValidator(value):
+    if not settingsNumberValidator(value):
+        return False
+    return value >= minimumSampleInterval
+
 def settingsWindowSizeValidator(value):
     if not isinstance(value, int):
         return False
@@ -191,12 +282,46 @@ settings.fontName : The font name. Must be a string.
 settings.fontSize : The font size. Must be a positive number.
 settings.availableFonts : Names of installed monospaced fonts. This is read only.
 settings.showInvisibleCharacters : Show invisible characters. Must be a boolean.
+settings.syntaxHighlighting : Color keywords, strings, numbers and comments in the code being typed. Must be a boolean.
+
+- Output
+settings.tagThreadOutput : Prefix lines written by background threads with the thread name. Must be a boolean.
+
+- Results
+settings.resultMaxItems : The number of items shown per container in a result. Must be a positive integer.
+settings.resultMaxDepth : The number of nested containers shown in a result. Must be a positive integer.
+settings.resultMaxLength : The number of characters shown for a result. Must be a positive integer.
+settings.resultHistorySize : The number of results kept in the history. Must be a positive integer.
+settings.resultHistoryMaxBytes : The estimated number of bytes the history may hold. Must be a positive integer.
+settings.resultHistoryWeakThreshold : Results estimated to be at least this many bytes are held weakly. 0 turns this off. Must be a positive number.
+
+- Profiling
+settings.profilerInterval : The number of seconds between samples taken by %sample. Must be a number of at least 0.0001.
+
+- Sessions
+settings.sessionDirectory : The directory that %save_session and %load_session use for session names and %record puts recordings in. Must be a string.
+
+- Modules
+settings.autoReload** : Reload changed modules before each command. Must be a boolean.
+
+- Kernels
+settings.kernelName** : Windows with the same kernel name share one namespace, running commands one at a time. An empty string gives every window its own namespace. Must be a string.
+
+- Transcript
+settings.transcriptPath : A file that all code and output is written to. An empty string turns this off. Must be a string.
+settings.transcriptMaxBytes : The size at which the transcript file is rotated. 0 turns this off. Must be a positive integer or 0.
+settings.transcriptBackupCount : The number of rotated transcript files to keep. Must be a positive integer or 0.
+settings.transcriptCompress : Write the transcript gzip compressed. Must be a boolean.
 
 - Colors
 settings.colorCode : The color for code text. Must be a color tuple.
 settings.colorStdout : The color for stdout text. Must be a color tuple*.
 settings.colorStderr : The color for stderr text. Must be a color tuple*.
 settings.colorBackground : The background color. Must be a color tuple*.
+settings.colorKeyword : The color for keywords in the code being typed. Must be a color tuple.
+settings.colorString : The color for strings in the code being typed. Must be a color tuple.
+settings.colorNumber : The color for numbers in the code being typed. Must be a color tuple.
+settings.colorComment : The color for comments in the code being typed. Must be a color tuple.
 
 - Themes
 loadTheme("name") : Load a theme. The defaults are "default", "classic" and "robofog".
@@ -269,10 +394,30 @@ class PyREPLSettings(object):
     colorStdout = settingsProperty("colorStdout", settingsColorValidator)
     colorStderr = settingsProperty("colorStderr", settingsColorValidator)
     colorBackground = settingsProperty("colorBackground", settingsColorValidator)
+    colorKeyword = settingsProperty("colorKeyword", settingsColorValidator)
+    colorString = settingsProperty("colorString", settingsColorValidator)
+    colorNumber = settingsProperty("colorNumber", settingsColorValidator)
+    colorComment = settingsProperty("colorComment", settingsColorValidator)
     bannerGreeting = settingsProperty("bannerGreeting", settingsStringValidator)
     startupCode = settingsProperty("startupCode", settingsStringValidator)
     tabString = settingsProperty("tabString", settingsStringValidator)
     showInvisibleCharacters = settingsProperty("showInvisibleCharacters", settingsBoolValidator)
+    tagThreadOutput = settingsProperty("tagThreadOutput", settingsBoolValidator)
+    syntaxHighlighting = settingsProperty("syntaxHighlighting", settingsBoolValidator)
+    resultMaxItems = settingsProperty("resultMaxItems", settingsPositiveIntegerValidator)
+    resultMaxDepth = settingsProperty("resultMaxDepth", settingsPositiveIntegerValidator)
+    resultMaxLength = settingsProperty("resultMaxLength", settingsPositiveIntegerValidator)
+    resultHistorySize = settingsProperty("resultHistorySize", settingsPositiveIntegerValidator)
+    resultHistoryMaxBytes = settingsProperty("resultHistoryMaxBytes", settingsPositiveIntegerValidator)
+    resultHistoryWeakThreshold = settingsProperty("resultHistoryWeakThreshold", settingsPositiveNumberValidator)
+    profilerInterval = settingsProperty("profilerInterval", settingsProfilerIntervalValidator)
+    sessionDirectory = settingsProperty("sessionDirectory", settingsStringValidator)
+    autoReload = settingsProperty("autoReload", settingsBoolValidator)
+    kernelName = settingsProperty("kernelName", settingsStringValidator)
+    transcriptPath = settingsProperty("transcriptPath", settingsStringValidator)
+    transcriptMaxBytes = settingsProperty("transcriptMaxBytes", settingsCountValidator)
+    transcriptBackupCount = settingsProperty("transcriptBackupCount", settingsCountValidator)
+    transcriptCompress = settingsProperty("transcriptCompress", settingsBoolValidator)
 
     def editorItems(self):
         d = dict(
@@ -282,8 +427,14 @@ class PyREPLSettings(object):
             colorStdout=self.colorStdout,
             colorStderr=self.colorStderr,
             colorBackground=self.colorBackground,
+            colorKeyword=self.colorKeyword,
+            colorString=self.colorString,
+            colorNumber=self.colorNumber,
+            colorComment=self.colorComment,
             tabString=self.tabString,
-            showInvisibleCharacters=self.showInvisibleCharacters
+            showInvisibleCharacters=self.showInvisibleCharacters,
+            tagThreadOutput=self.tagThreadOutput,
+            syntaxHighlighting=self.syntaxHighlighting
         )
         return d.items()
 
@@ -317,6 +468,12 @@ class PyREPLSettings(object):
         self.colorStdout = theme["colorStdout"]
         self.colorStderr = theme["colorStderr"]
         self.colorBackground = theme["colorBackground"]
+        # themes saved before syntax highlighting
+        # existed don't have these colors
+        self.colorKeyword = theme.get("colorKeyword", theme["colorCode"])
+        self.colorString = theme.get("colorString", theme["colorCode"])
+        self.colorNumber = theme.get("colorNumber", theme["colorCode"])
+        self.colorComment = theme.get("colorComment", theme["colorCode"])
 
     def saveTheme(self, name):
         if not settingsStringValidator(name):
@@ -325,7 +482,11 @@ class PyREPLSettings(object):
             colorCode=self.colorCode,
             colorStderr=self.colorStderr,
             colorStdout=self.colorStdout,
-            colorBackground=self.colorBackground
+            colorBackground=self.colorBackground,
+            colorKeyword=self.colorKeyword,
+            colorString=self.colorString,
+            colorNumber=self.colorNumber,
+            colorComment=self.colorComment
         )
         userThemes = getDefaultValue("userThemes")
         userThemes[name] = theme
@@ -344,10 +505,30 @@ class PyREPLSettings(object):
                 colorStdout=tuple(self.colorStdout),
                 colorStderr=tuple(self.colorStderr),
                 colorBackground=tuple(self.colorBackground),
+                colorKeyword=tuple(self.colorKeyword),
+                colorString=tuple(self.colorString),
+                colorNumber=tuple(self.colorNumber),
+                colorComment=tuple(self.colorComment),
                 bannerGreeting=str(self.bannerGreeting),
                 startupCode=str(self.startupCode),
                 tabString=str(self.tabString),
                 showInvisibleCharacters=bool(self.showInvisibleCharacters),
+                tagThreadOutput=bool(self.tagThreadOutput),
+                syntaxHighlighting=bool(self.syntaxHighlighting),
+                resultMaxItems=int(self.resultMaxItems),
+                resultMaxDepth=int(self.resultMaxDepth),
+                resultMaxLength=int(self.resultMaxLength),
+                resultHistorySize=int(self.resultHistorySize),
+                resultHistoryMaxBytes=int(self.resultHistoryMaxBytes),
+                resultHistoryWeakThreshold=int(self.resultHistoryWeakThreshold),
+                profilerInterval=float(self.profilerInterval),
+                sessionDirectory=str(self.sessionDirectory),
+                autoReload=bool(self.autoReload),
+                kernelName=str(self.kernelName),
+                transcriptPath=str(self.transcriptPath),
+                transcriptMaxBytes=int(self.transcriptMaxBytes),
+                transcriptBackupCount=int(self.transcriptBackupCount),
+                transcriptCompress=bool(self.transcriptCompress),
                 userThemes=dict(getDefaultValue("userThemes"))
             )
 
@@ -380,6 +561,14 @@ class PyREPLSettings(object):
                 self.colorStderr = tuple(d["colorStderr"])
             if "colorBackground" in d.keys():
                 self.colorBackground = tuple(d["colorBackground"])
+            if "colorKeyword" in d.keys():
+                self.colorKeyword = tuple(d["colorKeyword"])
+            if "colorString" in d.keys():
+                self.colorString = tuple(d["colorString"])
+            if "colorNumber" in d.keys():
+                self.colorNumber = tuple(d["colorNumber"])
+            if "colorComment" in d.keys():
+                self.colorComment = tuple(d["colorComment"])
             if "bannerGreeting" in d.keys():
                 self.bannerGreeting = str(d["bannerGreeting"])
             if "startupCode" in d.keys():
@@ -388,6 +577,38 @@ class PyREPLSettings(object):
                 self.tabString = str(d["tabString"])
             if "showInvisibleCharacters" in d.keys():
                 self.showInvisibleCharacters = bool(d["showInvisibleCharacters"])
+            if "tagThreadOutput" in d.keys():
+                self.tagThreadOutput = bool(d["tagThreadOutput"])
+            if "syntaxHighlighting" in d.keys():
+                self.syntaxHighlighting = bool(d["syntaxHighlighting"])
+            if "resultMaxItems" in d.keys():
+                self.resultMaxItems = int(d["resultMaxItems"])
+            if "resultMaxDepth" in d.keys():
+                self.resultMaxDepth = int(d["resultMaxDepth"])
+            if "resultMaxLength" in d.keys():
+                self.resultMaxLength = int(d["resultMaxLength"])
+            if "resultHistorySize" in d.keys():
+                self.resultHistorySize = int(d["resultHistorySize"])
+            if "resultHistoryMaxBytes" in d.keys():
+                self.resultHistoryMaxBytes = int(d["resultHistoryMaxBytes"])
+            if "resultHistoryWeakThreshold" in d.keys():
+                self.resultHistoryWeakThreshold = int(d["resultHistoryWeakThreshold"])
+            if "profilerInterval" in d.keys():
+                self.profilerInterval = float(d["profilerInterval"])
+            if "sessionDirectory" in d.keys():
+                self.sessionDirectory = str(d["sessionDirectory"])
+            if "autoReload" in d.keys():
+                self.autoReload = bool(d["autoReload"])
+            if "kernelName" in d.keys():
+                self.kernelName = str(d["kernelName"])
+            if "transcriptPath" in d.keys():
+                self.transcriptPath = str(d["transcriptPath"])
+            if "transcriptMaxBytes" in d.keys():
+                self.transcriptMaxBytes = int(d["transcriptMaxBytes"])
+            if "transcriptBackupCount" in d.keys():
+                self.transcriptBackupCount = int(d["transcriptBackupCount"])
+            if "transcriptCompress" in d.keys():
+                self.transcriptCompress = bool(d["transcriptCompress"])
             if "userThemes" in d.keys():
                 setDefaultValue("userThemes", dict(d["userThemes"]))
 
@@ -428,7 +649,7 @@ class PyREPLWindow(BaseWindowController):
         self.w = windowClass((600, 400), "RoboREPL", minSize=(350, 200))
         self.w.editor = PyREPLTextEditor((0, 0, 0, 0))
         self.loadSettings()
-        self.w.editor.startSession(settingsManager.bannerGreeting, settingsManager.startupCode)
+        self.w.editor.startSession(settingsManager.bannerGreeting, settingsManager.startupCode, settingsManager.kernelName)
 
         window = self.w.getNSWindow()
         window.setOpaque_(False)
@@ -442,6 +663,7 @@ class PyREPLWindow(BaseWindowController):
         self.w.makeKey()
 
     def windowClosedCallback(self, sender):
+        self.w.editor.endSession()
         settingsManager.removeObserver(self)
         settingsManager.removeObserver(self, notification="PyREPL.ShowStartupCodeEditor")
 
@@ -463,7 +685,13 @@ class PyREPLWindow(BaseWindowController):
             colorStdout=self.w.editor.setStdoutColor,
             colorStderr=self.w.editor.setStderrColor,
             colorBackground=self.w.editor.setBackgroundColor,
-            showInvisibleCharacters=self.w.editor.setShowInvisibles
+            colorKeyword=self.w.editor.setKeywordColor,
+            colorString=self.w.editor.setStringColor,
+            colorNumber=self.w.editor.setNumberColor,
+            colorComment=self.w.editor.setCommentColor,
+            showInvisibleCharacters=self.w.editor.setShowInvisibles,
+            tagThreadOutput=self.w.editor.setTagThreadOutput,
+            syntaxHighlighting=self.w.editor.setSyntaxHighlighting
         )
         if key in editorMethods:
             editorMethods[key](value)
@@ -530,17 +758,28 @@ class PyREPLTextView(AppKit.NSTextView):
         self._codeColor = AppKit.NSColor.blackColor()
         self._stderrColor = AppKit.NSColor.blackColor()
         self._stdoutColor = AppKit.NSColor.blackColor()
+        self._syntaxColors = {}
         self._glyphWidth = 1
 
+        self._kernel = None
         self._console = None
-        self._stderr = PseudoUTF8Output(self.writeStderr_)
-        self._stdout = PseudoUTF8Output(self.writeStdout_)
+        self._waitingForKernel = False
+        self._transcriptSource = "window %d" % next(transcriptSourceCounter)
+        self._outputQueue = PyREPLOutputQueue(self.scheduleOutputDrain)
+        self._stderr = PseudoUTF8Output(self._outputQueue, "stderr")
+        self._stdout = PseudoUTF8Output(self._outputQueue, "stdout")
         self._prompt = sys.ps1
         self.previousOutput = ""
 
         self._tabString = "  "
+        self._tagThreadOutput = False
+        self._threadLineStarts = {}
+
+        self._syntaxHighlighting = False
+        self._highlighter = InputHighlighter()
 
         self._minInsertionPoint = 0
+        self._promptLocation = None
 
         self._history = []
         self._historyIndex = 1
@@ -569,6 +808,15 @@ class PyREPLTextView(AppKit.NSTextView):
         self._codeColor = color
         self.setTextColor_(color)
         self.setInsertionPointColor_(color)
+        self.rehighlightInput()
+
+    def setSyntaxColor_forKind_(self, color, kind):
+        self._syntaxColors[kind] = color
+        self.rehighlightInput()
+
+    def setSyntaxHighlighting_(self, value):
+        self._syntaxHighlighting = value
+        self.rehighlightInput()
 
     def setStdoutColor_(self, color):
         self._stdoutColor = color
@@ -579,6 +827,9 @@ class PyREPLTextView(AppKit.NSTextView):
     def setShowInvisibles_(self, value):
         self.layoutManager().setShowsInvisibleCharacters_(value)
 
+    def setTagThreadOutput_(self, value):
+        self._tagThreadOutput = value
+
     # Raw Text
 
     def rawText(self):
@@ -606,15 +857,32 @@ class PyREPLTextView(AppKit.NSTextView):
             return super(PyREPLTextView, self).keyDown_(event)
 
     def insertNewline_(self, sender):
+        if self._waitingForKernel:
+            AppKit.NSBeep()
+            return
         line = self.currentLine()
         self.writeCode_("\n")
+        transcript = transcriptManager.writer
+        if transcript is not None:
+            transcript.write(self._transcriptSource, "code", self._prompt + line + "\n")
+        self._promptLocation = None
+        self._waitingForKernel = True
+        self._kernel.submit(self, line)
+
+    def runSubmittedLine_(self, line):
+        self._waitingForKernel = False
         self.executeLine_(line)
+        if self._prompt == sys.ps2:
+            self._highlighter.pushBlockLine(line)
+        else:
+            self._highlighter.resetBlock()
         self.writePrompt()
 
     insertNewlineIgnoringFieldEditor_ = insertNewline_
 
     def insertTab_(self, sender):
         self.writeLine_withColor_(self._tabString, self._codeColor)
+        self.highlightInput()
 
     def insertBacktab_(self, sender):
         if self.currentLine().endswith(self._tabString):
@@ -622,6 +890,7 @@ class PyREPLTextView(AppKit.NSTextView):
             begin = self.textLength() - length
             textStorage = self.textStorage()
             textStorage.deleteCharactersInRange_((begin, length))
+            self.highlightInput()
 
     def moveDown_(self, sender):
         self._historyIndex += 1
@@ -647,6 +916,51 @@ class PyREPLTextView(AppKit.NSTextView):
         length = self.textLength() - begin
         textStorage = self.textStorage()
         textStorage.replaceCharactersInRange_withAttributedString_((begin, length), text)
+        self.highlightInput()
+
+    def didChangeText(self):
+        super(PyREPLTextView, self).didChangeText()
+        self.highlightInput()
+
+    # Syntax Highlighting
+    #
+    # Only the text after the prompt is colored. The
+    # highlighter keeps the tokenizer state of every
+    # line and reports which range actually changed, so
+    # typing in a long pasted block only recolors the
+    # lines that need it.
+
+    def highlightInput(self):
+        if not self._syntaxHighlighting or self._promptLocation is None:
+            return
+        begin = self._minInsertionPoint
+        textStorage = self.textStorage()
+        length = textStorage.length()
+        if begin > length:
+            return
+        # only the input region crosses the bridge, not the transcript
+        text = textStorage.attributedSubstringFromRange_((begin, length - begin)).string()
+        start, end, runs = self._highlighter.update(text)
+        if start == end:
+            return
+        colorKey = AppKit.NSForegroundColorAttributeName
+        textStorage.beginEditing()
+        textStorage.addAttribute_value_range_(colorKey, self._codeColor, (begin + start, end - start))
+        for location, length, kind in runs:
+            color = self._syntaxColors.get(kind, self._codeColor)
+            textStorage.addAttribute_value_range_(colorKey, color, (begin + location, length))
+        textStorage.endEditing()
+
+    def rehighlightInput(self):
+        self._highlighter.clear()
+        if self._syntaxHighlighting:
+            self.highlightInput()
+        elif self._promptLocation is not None:
+            begin = self._minInsertionPoint
+            textStorage = self.textStorage()
+            length = textStorage.length() - begin
+            if length > 0:
+                textStorage.addAttribute_value_range_(AppKit.NSForegroundColorAttributeName, self._codeColor, (begin, length))
 
     # Output
 
@@ -668,8 +982,10 @@ class PyREPLTextView(AppKit.NSTextView):
         self.scrollToEnd()
 
     def writePrompt(self):
+        self._promptLocation = self.textLength()
         self.writeCode_(self._prompt)
         self._minInsertionPoint = self.textLength()
+        self._highlighter.clear()
 
     def writeCode_(self, text):
         self.writeLine_withColor_(text, self._codeColor)
@@ -680,6 +996,60 @@ class PyREPLTextView(AppKit.NSTextView):
     def writeStdout_(self, text):
         self.writeLine_withColor_(text, self._stdoutColor)
 
+    # Queued Output
+    #
+    # Everything written to the console's stdout and stderr,
+    # from any thread, goes into a queue that is drained on
+    # the main thread. While a command is executing, output
+    # is appended to the end of the text. Between commands,
+    # output (usually from background threads) is inserted
+    # above the current prompt so that any half-typed input
+    # is left alone.
+
+    def scheduleOutputDrain(self):
+        self.performSelectorOnMainThread_withObject_waitUntilDone_("drainOutput:", None, False)
+
+    def drainOutput_(self, sender):
+        items = self._outputQueue.get()
+        if not items:
+            return
+        runs = []
+        for stream, threadName, text in items:
+            if threadName is not None and self._tagThreadOutput:
+                atLineStart = self._threadLineStarts.get(threadName, True)
+                text, atLineStart = tagOutputLines(text, "[%s] " % threadName, atLineStart)
+                self._threadLineStarts[threadName] = atLineStart
+            if runs and runs[-1][0] == stream:
+                runs[-1][1].append(text)
+            else:
+                runs.append((stream, [text]))
+        output = AppKit.NSMutableAttributedString.alloc().init()
+        transcript = transcriptManager.writer
+        for stream, texts in runs:
+            if stream == "stderr":
+                color = self._stderrColor
+            else:
+                color = self._stdoutColor
+            text = "".join(texts)
+            output.appendAttributedString_(self.makeAttributedString_withColor_(text, color))
+            if transcript is not None:
+                transcript.write(self._transcriptSource, stream, text)
+        textStorage = self.textStorage()
+        if self._promptLocation is None:
+            textStorage.appendAttributedString_(output)
+            self.scrollToEnd()
+        else:
+            length = output.length()
+            location = self._promptLocation
+            selectionLocation, selectionLength = self.selectedRange()
+            textStorage.insertAttributedString_atIndex_(output, location)
+            self._promptLocation += length
+            self._minInsertionPoint += length
+            if selectionLocation >= location:
+                selectionLocation += length
+            self.setSelectedRange_((selectionLocation, selectionLength))
+            self.scrollRangeToVisible_((self.textLength(), 0))
+
     def clear(self):
         self._minInsertionPoint = 0
         self.setString_("")
@@ -687,23 +1057,23 @@ class PyREPLTextView(AppKit.NSTextView):
 
     # Execution
 
-    def startSession_(self, startupCode):
-        namespace = dict(namespaceInjections)
-        if startupCode is not None:
-            try:
-                code = compile(startupCode, "", "exec", 0)
-            except:
-                traceback.print_exc(0)
-            else:
-                try:
-                    exec(code, namespace)
-                except:
-                    etype, value, tb = sys.exc_info()
-                    if tb.tb_next is not None:
-                        tb = tb.tb_next
-                    traceback.print_exception(etype, value, tb)
-                    etype = value = tb = None
-        self._console = InteractiveConsole(locals=namespace)
+    def startSession_kernelName_(self, startupCode, kernelName):
+        self._kernel = getKernel(kernelName, startupCode)
+        self._kernel.attach(self)
+        # Every view has its own console so that partially
+        # entered blocks don't get mixed up between views
+        # sharing a kernel.
+        self._console = AsyncConsole(locals=self._kernel.namespace, loop=self._kernel.loop)
+        outputRouter.addView(self)
+
+    def outputStreams(self):
+        return self._stdout, self._stderr
+
+    def endSession(self):
+        if self._kernel is not None:
+            self._kernel.detach(self)
+            self._kernel = None
+            outputRouter.removeView(self)
 
     def currentLine(self):
         line = self.rawText().splitlines()[-1]
@@ -717,12 +1087,21 @@ class PyREPLTextView(AppKit.NSTextView):
             return
         self._history.append(line)
         self._historyIndex = len(self._history)
-        save = (sys.stdout, sys.stderr, self.rawText())
+        commands = self._kernel.commands
+        threadsBefore = outputRouter.runningThreads()
+        save = (sys.stdout, sys.stderr, sys.displayhook, self.rawText())
         sys.stdout = self._stdout
         sys.stderr = self._stderr
+        sys.displayhook = self._kernel.displayHook
         more = False
         try:
-            more = self._console.push(line)
+            if self._prompt == sys.ps1 and commands.isCommand(line):
+                commands.run(line)
+                more = False
+            else:
+                if self._prompt == sys.ps1:
+                    commands.reloadChangedModules()
+                more = commands.push(self._console, line)
             if more:
                 self._prompt = sys.ps2
             else:
@@ -730,7 +1109,9 @@ class PyREPLTextView(AppKit.NSTextView):
         except:
             self._prompt = sys.ps1
         finally:
-            sys.stdout, sys.stderr, previousRawText = save
+            sys.stdout, sys.stderr, sys.displayhook, previousRawText = save
+            outputRouter.adoptNewThreads(self, threadsBefore)
+            self.drainOutput_(None)
             self.previousOutput = self.rawText()[len(previousRawText):-1]
 
     # Selection, Insertion Point
@@ -745,6 +1126,8 @@ class PyREPLTextView(AppKit.NSTextView):
         return toRange
 
     def textView_shouldChangeTextInRange_replacementString_(self, textView, aRange, newString):
+        if self._waitingForKernel:
+            return False
         begin, length = aRange
         if begin < self._minInsertionPoint:
             return False
@@ -793,35 +1176,11 @@ class PyREPLTextView(AppKit.NSTextView):
         return completions, 0
 
     def selectionRangeForProposedRange_granularity_(self, proposedRange, granularity):
-        location = proposedRange.location
-        if granularity == AppKit.NSSelectByWord and proposedRange.length == 0 and location != 0:
-            text = self.string()
-            lenText = len(text)
-            length = 1
-            found = False
-            while not found:
-                location -= 1
-                length += 1
-                if location <= 0:
-                    found = True
-                else:
-                    c = text.substringWithRange_((location, 1))[0]
-                    if c not in variableChars:
-                        location += 1
-                        found = True
-            found = False
-            while not found:
-                length += 1
-                if location + length >= lenText:
-                    found = True
-                else:
-                    c = text.substringWithRange_((location, length))[-1]
-                    if c not in variableChars:
-                        length -= 1
-                        found = True
-            return location, length
-        else:
-            return super(PyREPLTextView, self).selectionRangeForProposedRange_granularity_(proposedRange, granularity)
+        if granularity == AppKit.NSSelectByWord and proposedRange.length == 0:
+            found = findTokenRangeInTextStorage(self.textStorage(), proposedRange.location)
+            if found is not None:
+                return found
+        return super(PyREPLTextView, self).selectionRangeForProposedRange_granularity_(proposedRange, granularity)
 
     # Drop
 
@@ -855,14 +1214,19 @@ class PyREPLTextEditor(vanilla.TextEditor):
         self._fontName = "Menlo-Regular"
         self._fontSize = 10
 
-    def startSession(self, banner=None, startupCode=None):
+    def startSession(self, banner=None, startupCode=None, kernelName=None):
         textView = self.getNSTextView()
         if banner:
             textView.writeStdout_(banner)
             textView.writeStdout_("\n")
-        textView.startSession_(startupCode)
+        if kernelName and kernelName in sharedKernels:
+            textView.writeStdout_("Attached to kernel %r.\n" % kernelName)
+        textView.startSession_kernelName_(startupCode, kernelName)
         textView.writePrompt()
 
+    def endSession(self):
+        self.getNSTextView().endSession()
+
     def getCharacterBox(self):
         return self.getNSTextView().getCharacterBox()
 
@@ -903,13 +1267,358 @@ class PyREPLTextEditor(vanilla.TextEditor):
         r, g, b, a = value
         return AppKit.NSColor.colorWithCalibratedRed_green_blue_alpha_(r, g, b, a)
 
+    def setKeywordColor(self, value):
+        color = self._makeColor(value)
+        self.getNSTextView().setSyntaxColor_forKind_(color, "keyword")
+
+    def setStringColor(self, value):
+        color = self._makeColor(value)
+        self.getNSTextView().setSyntaxColor_forKind_(color, "string")
+
+    def setNumberColor(self, value):
+        color = self._makeColor(value)
+        self.getNSTextView().setSyntaxColor_forKind_(color, "number")
+
+    def setCommentColor(self, value):
+        color = self._makeColor(value)
+        self.getNSTextView().setSyntaxColor_forKind_(color, "comment")
+
     def setShowInvisibles(self, value):
         self.getNSTextView().setShowInvisibles_(value)
 
+    def setSyntaxHighlighting(self, value):
+        self.getNSTextView().setSyntaxHighlighting_(value)
+
+    def setTagThreadOutput(self, value):
+        self.getNSTextView().setTagThreadOutput_(value)
+
 # -----------
 # Interpreter
 # -----------
 
+class PyREPLCommandError(Exception): pass
+
+
+class PyREPLCommands(object):
+
+    """
+    Handles lines starting with %. The text following
+    the % up to the first space is the command name.
+    Everything after that is given to the command_name
+    method as a string.
+    """
+
+    def __init__(self, kernel):
+        self.kernel = kernel
+        self.protectedNames = set()
+        self.startupNames = set()
+        self.recorder = None
+        self._pendingProfile = None
+
+    def isCommand(self, line):
+        return line.lstrip().startswith("%")
+
+    def push(self, console, line):
+        """
+        Push line to console, sampling it if profiling of
+        the next command was requested and timing it if the
+        session is being recorded.
+        """
+        recorder = self.recorder
+        if recorder is None:
+            return self._push(console, line)
+        # sys.stdout and sys.stderr are the outputs of the
+        # view that submitted the line
+        outputStart = countOutput()
+        start = time.perf_counter()
+        more = self._push(console, line)
+        seconds = time.perf_counter() - start
+        recorder.addLine(console, line, seconds, countOutput() - outputStart, more)
+        return more
+
+    def _push(self, console, line):
+        if self._pendingProfile is None:
+            return console.push(line)
+        profiler, count, path = self._pendingProfile
+        with profiler:
+            more = console.push(line)
+        if not more:
+            self._pendingProfile = None
+            self._reportProfile(profiler, count, path)
+        return more
+
+    def run(self, line):
+        name, _, argument = line.strip()[1:].partition(" ")
+        method = getattr(self, "command_" + name, None)
+        try:
+            if method is None:
+                raise PyREPLCommandError("Unknown command: %%%s" % name)
+            method(argument.strip())
+        except PyREPLCommandError as e:
+            print(str(e), file=sys.stderr)
+        except:
+            traceback.print_exc()
+
+    # Results
+
+    def command_results(self, argument):
+        history = self.kernel.resultHistory
+        if argument == "clear":
+            history.clear()
+            # the pager holds the last truncated result
+            self.kernel.displayHook.pager = None
+        elif argument:
+            raise PyREPLCommandError("Usage: %results [clear]")
+        else:
+            history.report()
+
+    # Memory
+
+    def _parseArguments(self, argument):
+        flags = set()
+        patterns = []
+        for part in argument.split():
+            if part.startswith("-"):
+                flags.add(part)
+            else:
+                patterns.append(part)
+        return flags, patterns
+
+    def _matchNames(self, patterns):
+        namespace = self.kernel.namespace
+        names = [
+            name for name in namespace
+            if name not in self.protectedNames and not name.startswith("__")
+        ]
+        if not patterns:
+            return sorted(names)
+        matched = set()
+        for pattern in patterns:
+            found = fnmatch.filter(names, pattern)
+            if not found:
+                raise PyREPLCommandError("No names match %r." % pattern)
+            matched.update(found)
+        return sorted(matched)
+
+    def command_whos(self, argument):
+        flags, patterns = self._parseArguments(argument)
+        if flags - {"-r"}:
+            raise PyREPLCommandError("Usage: %whos [pattern ...] [-r]")
+        names = self._matchNames(patterns)
+        roboREPLMemory.whos(self.kernel.namespace, names, showReferrers="-r" in flags)
+
+    def command_reset(self, argument):
+        flags, patterns = self._parseArguments(argument)
+        if flags:
+            raise PyREPLCommandError("Usage: %reset [pattern ...]")
+        names = self._matchNames(patterns)
+        if not patterns:
+            self.kernel.resultHistory.clear()
+            names = [name for name in names if name not in self.startupNames]
+            names = [name for name in names if name in self.kernel.namespace]
+        # The pager holds the last truncated result, which
+        # is usually the value the user wants to get rid of.
+        displayHook = self.kernel.displayHook
+        pager = displayHook.pager
+        if pager is not None:
+            namespace = self.kernel.namespace
+            if not patterns or any(namespace.get(name) is pager.value for name in names):
+                displayHook.pager = None
+            pager = None
+        roboREPLMemory.reset(self.kernel.namespace, names)
+
+    # Sessions
+
+    resultNamePattern = re.compile(r"_\d*$")
+
+    def _getSessionPath(self, name):
+        if not name:
+            name = "default"
+        if os.sep in name or name.endswith(roboREPLSession.sessionFileExtension):
+            return os.path.expanduser(name)
+        directory = os.path.expanduser(settingsManager.sessionDirectory)
+        return os.path.join(directory, name + roboREPLSession.sessionFileExtension)
+
+    def command_save_session(self, argument):
+        parts = argument.split()
+        if parts:
+            path = self._getSessionPath(parts.pop(0))
+        else:
+            path = self._getSessionPath(None)
+        names = [
+            name for name in self._matchNames(parts)
+            if name not in self.startupNames and not self.resultNamePattern.match(name)
+        ]
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        report = roboREPLSession.saveSession(path, self.kernel.namespace, names)
+        report.printReport("Saved")
+        print("Session written to %s" % path)
+
+    def command_load_session(self, argument):
+        path = self._getSessionPath(argument)
+        if not os.path.exists(path):
+            raise PyREPLCommandError("No session file at %s" % path)
+        try:
+            values, report = roboREPLSession.loadSession(path)
+        except roboREPLSession.SessionError as e:
+            raise PyREPLCommandError(str(e))
+        self.kernel.namespace.update(values)
+        report.printReport("Loaded")
+
+    # Kernel
+
+    def command_kernel(self, argument):
+        if argument:
+            raise PyREPLCommandError("Usage: %kernel")
+        if self.kernel.name:
+            print("Shared kernel %r with %d attached windows." % (self.kernel.name, self.kernel.viewCount()))
+        else:
+            print("This window has its own kernel. Set settings.kernelName to share a kernel between new windows.")
+
+    # Recording
+
+    def command_record(self, argument):
+        usage = "Usage: %record start [path] or %record stop"
+        action, _, path = argument.partition(" ")
+        path = path.strip()
+        if action == "start":
+            if self.recorder is not None:
+                raise PyREPLCommandError("Already recording to %s" % self.recorder.path)
+            if path:
+                path = os.path.expanduser(path)
+            else:
+                directory = os.path.expanduser(settingsManager.sessionDirectory)
+                path = os.path.join(directory, time.strftime("Recording %Y-%m-%d %H.%M.%S.json"))
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            fontPaths, unsaved = getOpenFontPaths()
+            self.recorder = SessionRecorder(
+                path,
+                startupCode=self.kernel.startupCode,
+                fontPaths=fontPaths,
+                resultLimits=(settingsManager.resultMaxItems, settingsManager.resultMaxDepth, settingsManager.resultMaxLength),
+                historyLimits=getResultHistoryLimits()
+            )
+            print("Recording to %s" % path)
+            if unsaved:
+                print("%d open fonts have never been saved and can't be opened by a replay." % unsaved, file=sys.stderr)
+        elif action == "stop" and not path:
+            if self.recorder is None:
+                raise PyREPLCommandError("Nothing is being recorded.")
+            self.saveRecording()
+        elif not argument:
+            if self.recorder is None:
+                print("Nothing is being recorded.")
+            else:
+                print("Recorded %d commands so far to %s" % (len(self.recorder.commands), self.recorder.path))
+        else:
+            raise PyREPLCommandError(usage)
+
+    def saveRecording(self):
+        recorder = self.recorder
+        if recorder is None:
+            return
+        self.recorder = None
+        recorder.save()
+        print("Recorded %d commands to %s" % (len(recorder.commands), recorder.path))
+
+    # Modules
+
+    def reloadChangedModules(self):
+        reloader = self.kernel.moduleReloader
+        if reloader is None:
+            return
+        reloaded, duration = reloader.reloadChanged(self.kernel.namespace)
+        if reloaded:
+            print("Reloaded %s in %.1f ms." % (", ".join(reloaded), duration * 1000))
+
+    def command_autoreload(self, argument):
+        if argument == "on":
+            if self.kernel.moduleReloader is None:
+                self.kernel.moduleReloader = ModuleReloader()
+                self.kernel.moduleReloader.update()
+        elif argument == "off":
+            self.kernel.moduleReloader = None
+        elif argument:
+            raise PyREPLCommandError("Usage: %autoreload [on|off]")
+        reloader = self.kernel.moduleReloader
+        if reloader is None:
+            print("Automatic reloading is off.")
+        else:
+            reloader.update()
+            names = reloader.moduleNames()
+            if names:
+                print("Automatic reloading is on. Watching: %s" % ", ".join(names))
+            else:
+                print("Automatic reloading is on. No modules are being watched yet.")
+
+    # Profiling
+
+    def command_sample(self, argument):
+        usage = "Usage: %sample [-n count] [-o path] [statement]"
+        count = 20
+        path = None
+        parts = argument.split(" ")
+        while parts and parts[0] in ("-n", "-o"):
+            option = parts.pop(0)
+            if not parts:
+                raise PyREPLCommandError(usage)
+            value = parts.pop(0)
+            if option == "-n":
+                try:
+                    count = int(value)
+                except ValueError:
+                    raise PyREPLCommandError(usage)
+            else:
+                path = value
+        statement = " ".join(parts).strip()
+        profiler = SamplingProfiler(interval=settingsManager.profilerInterval)
+        if not statement:
+            self._pendingProfile = (profiler, count, path)
+            print("The next command will be profiled.")
+            return
+        namespace = self.kernel.namespace
+        code = compile(statement, "<console>", "single")
+        try:
+            with profiler:
+                exec(code, namespace)
+        finally:
+            self._reportProfile(profiler, count, path)
+
+    def _reportProfile(self, profiler, count, path):
+        profiler.printSummary(count)
+        if path:
+            path = os.path.expanduser(path)
+            if path.endswith(".json"):
+                profiler.writeSpeedscope(path)
+            else:
+                profiler.writeCollapsed(path)
+            print("Samples written to %s" % path)
+
+
+def countOutput():
+    return getattr(sys.stdout, "characterCount", 0) + getattr(sys.stderr, "characterCount", 0)
+
+
+def getOpenFontPaths():
+    """
+    Get the paths of the open fonts, with the current font
+    first, and the number of open fonts that have no path.
+    """
+    if not inRoboFont:
+        return [], 0
+    fonts = list(mojo.roboFont.AllFonts())
+    current = mojo.roboFont.CurrentFont()
+    if current is not None and current in fonts:
+        fonts.remove(current)
+        fonts.insert(0, current)
+    paths = [font.path for font in fonts if font.path]
+    return paths, len(fonts) - len(paths)
+
+
 namespaceInjections = {
     "settings" : settingsManager
 }
@@ -924,15 +1633,301 @@ if inRoboFont:
     })
 
 
+class PyREPLKernel(object):
+
+    """
+    A namespace and the things that go with it: the result
+    history, the display hook, the commands and the module
+    reloader. A kernel can be shared by several text views.
+    Lines submitted by the views are executed one at a time,
+    in the order they were submitted, each with the output
+    going to the view that submitted it.
+    """
+
+    def __init__(self, name=None, startupCode=None):
+        self.name = name
+        self.startupCode = startupCode
+        namespace = dict(namespaceInjections)
+        self.namespace = namespace
+        self.resultHistory = ResultHistory(namespace, getResultHistoryLimits)
+        self.displayHook = DisplayHook(namespace, makeResultFormatter, self.resultHistory)
+        self.commands = PyREPLCommands(self)
+        namespace["Out"] = self.resultHistory
+        namespace["more"] = self.displayHook.more
+        namespace["show"] = self.displayHook.show
+        self.commands.protectedNames = set(namespace)
+        if startupCode is not None:
+            try:
+                code = compile(startupCode, "", "exec", 0)
+            except:
+                traceback.print_exc(0)
+            else:
+                try:
+                    exec(code, namespace)
+                except:
+                    etype, value, tb = sys.exc_info()
+                    if tb.tb_next is not None:
+                        tb = tb.tb_next
+                    traceback.print_exception(etype, value, tb)
+                    etype = value = tb = None
+        self.commands.startupNames = set(namespace)
+        self.moduleReloader = None
+        if settingsManager.autoReload:
+            self.moduleReloader = ModuleReloader()
+            self.moduleReloader.update()
+        self.loop = newEventLoop()
+        self._eventLoopPump = PyREPLEventLoopPump.alloc().initWithKernel_(self)
+        self._views = []
+        self._lastView = None
+        self._queue = deque()
+        self._executing = False
+
+    def attach(self, view):
+        self._views.append(view)
+
+    def detach(self, view):
+        if view in self._views:
+            self._views.remove(view)
+        if self._lastView is view:
+            self._lastView = None
+        self._queue = deque(item for item in self._queue if item[0] is not view)
+        if not self._views:
+            if sharedKernels.get(self.name) is self:
+                del sharedKernels[self.name]
+            try:
+                self.commands.saveRecording()
+            except OSError:
+                traceback.print_exc()
+            self._eventLoopPump.stop()
+            self._eventLoopPump = None
+            closeEventLoop(self.loop)
+
+    def viewCount(self):
+        return len(self._views)
+
+    def submit(self, view, line):
+        """
+        Queue line for execution in view. If nothing is
+        executing, the queue is run immediately. Otherwise
+        (a command is running a nested event loop and
+        another view submitted a line) the line is run
+        when the current command is finished.
+        """
+        self._queue.append((view, line))
+        if self._executing:
+            return
+        self._executing = True
+        try:
+            while self._queue:
+                view, line = self._queue.popleft()
+                self._lastView = view
+                view.runSubmittedLine_(line)
+        finally:
+            self._executing = False
+        if hasPendingTasks(self.loop):
+            self._eventLoopPump.start()
+
+    def runEventLoop(self):
+        """
+        Give tasks left running on the event loop a chance
+        to run between commands. Their output goes to the
+        view that submitted the most recent command.
+        """
+        if self._executing:
+            return
+        save = (sys.stdout, sys.stderr, sys.displayhook)
+        if self._lastView is not None:
+            sys.stdout, sys.stderr = self._lastView.outputStreams()
+        sys.displayhook = self.displayHook
+        try:
+            runEventLoopOnce(self.loop)
+        finally:
+            sys.stdout, sys.stderr, sys.displayhook = save
+        if not hasPendingTasks(self.loop):
+            self._eventLoopPump.stop()
+
+
+class PyREPLEventLoopPump(AppKit.NSObject):
+
+    """
+    Runs a kernel's event loop from a timer
+    while it has pending tasks.
+    """
+
+    interval = 0.02
+
+    def initWithKernel_(self, kernel):
+        self = super(PyREPLEventLoopPump, self).init()
+        self._kernel = kernel
+        self._timer = None
+        return self
+
+    def start(self):
+        if self._timer is None:
+            self._timer = AppKit.NSTimer.scheduledTimerWithTimeInterval_target_selector_userInfo_repeats_(
+                self.interval, self, "timerFired:", None, True
+            )
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.invalidate()
+            self._timer = None
+
+    def timerFired_(self, timer):
+        self._kernel.runEventLoop()
+
+
+sharedKernels = {}
+
+def getKernel(name, startupCode):
+    """
+    Get the shared kernel with name, creating it
+    if needed. If name is empty, a new kernel that
+    isn't shared is returned.
+    """
+    if not name:
+        return PyREPLKernel(None, startupCode)
+    kernel = sharedKernels.get(name)
+    if kernel is None:
+        kernel = sharedKernels[name] = PyREPLKernel(name, startupCode)
+    return kernel
+
+
+transcriptSourceCounter = itertools.count(1)
+
+
+class PyREPLTranscriptManager(object):
+
+    """
+    Holds the transcript writer for the current settings.
+    writer is None if there is no transcript path. The
+    writer is only replaced when a transcript setting
+    changes.
+    """
+
+    def __init__(self):
+        self.writer = None
+        self._settings = None
+        self.update()
+        settingsManager.addObserver(self, "settingsChangedCallback")
+
+    def settingsChangedCallback(self, notification):
+        for key in notification.data.keys():
+            if key.startswith("transcript"):
+                self.update()
+                break
+
+    def update(self):
+        currentSettings = (
+            settingsManager.transcriptPath,
+            settingsManager.transcriptMaxBytes,
+            settingsManager.transcriptBackupCount,
+            settingsManager.transcriptCompress
+        )
+        if currentSettings == self._settings:
+            return
+        self._settings = currentSettings
+        previous = self.writer
+        self.writer = None
+        if previous is not None:
+            # Don't wait here, the new writer waits
+            # for the old one before it writes.
+            previous.close(wait=False)
+        path, maxBytes, backupCount, compress = currentSettings
+        if path:
+            self.writer = TranscriptWriter(
+                os.path.expanduser(path),
+                maxBytes=maxBytes,
+                backupCount=backupCount,
+                compress=compress,
+                previous=previous
+            )
+
+transcriptManager = PyREPLTranscriptManager()
+
+
+def getResultHistoryLimits():
+    return (
+        settingsManager.resultHistorySize,
+        settingsManager.resultHistoryMaxBytes,
+        settingsManager.resultHistoryWeakThreshold
+    )
+
+
+def makeResultFormatter():
+    return LimitedRepr(
+        maxItems=settingsManager.resultMaxItems,
+        maxDepth=settingsManager.resultMaxDepth,
+        maxLength=settingsManager.resultMaxLength
+    )
+
+
+class PyREPLOutputQueue(object):
+
+    """
+    A queue of pending output that can be written to from any thread.
+
+    deque.append and deque.popleft are atomic, so writers never
+    take a lock. The first write after a drain calls scheduleDrain
+    so that the main thread picks up everything that has piled up
+    in one batch.
+    """
+
+    def __init__(self, scheduleDrain):
+        self._items = deque()
+        self._scheduleDrain = scheduleDrain
+        self._drainScheduled = False
+
+    def put(self, stream, text):
+        thread = threading.current_thread()
+        if thread is threading.main_thread():
+            threadName = None
+        else:
+            threadName = thread.name
+        self._items.append((stream, threadName, text))
+        if not self._drainScheduled:
+            self._drainScheduled = True
+            self._scheduleDrain()
+
+    def get(self):
+        self._drainScheduled = False
+        items = []
+        popleft = self._items.popleft
+        while True:
+            try:
+                items.append(popleft())
+            except IndexError:
+                break
+        return items
+
+
+def tagOutputLines(text, tag, atLineStart):
+    """
+    Prefix every line in text with tag. atLineStart indicates
+    if the previous write from the same source ended a line.
+    Returns the tagged text and the new atLineStart value.
+    """
+    tagged = []
+    for line in text.splitlines(True):
+        if atLineStart:
+            tagged.append(tag)
+        tagged.append(line)
+        atLineStart = line.endswith("\n")
+    return "".join(tagged), atLineStart
+
+
 class PseudoUTF8Output(object):
 
     softspace = 0
 
-    def __init__(self, writemethod):
-        self._write = writemethod
+    def __init__(self, outputQueue, stream):
+        self._outputQueue = outputQueue
+        self._stream = stream
+        self.characterCount = 0
 
     def write(self, s):
-        self._write(s)
+        self.characterCount += len(s)
+        self._outputQueue.put(self._stream, s)
 
     def writelines(self, lines):
         for line in lines:
@@ -945,6 +1940,114 @@ class PseudoUTF8Output(object):
         return True
 
 
+class PyREPLOutputRouter(object):
+
+    """
+    Sits on sys.stdout and sys.stderr while any window is
+    open. The window's own outputs are only on sys.stdout and
+    sys.stderr while a command executes, but threads started
+    by a command often print after it has returned. Threads
+    that were started while a command executed are remembered
+    along with the window that executed it, and their writes
+    are sent to that window. Writes from all other threads,
+    such as RoboFont's own, go to the stream that was there
+    before.
+    """
+
+    def __init__(self):
+        self._views = []
+        # thread ident : (thread, view)
+        self._threads = {}
+        self._originals = None
+
+    def addView(self, view):
+        if not self._views:
+            self._originals = (sys.stdout, sys.stderr)
+            sys.stdout = PyREPLRoutedOutput(self, sys.stdout, 0)
+            sys.stderr = PyREPLRoutedOutput(self, sys.stderr, 1)
+        self._views.append(view)
+
+    def removeView(self, view):
+        if view not in self._views:
+            return
+        self._views.remove(view)
+        self._threads = dict(
+            (ident, (thread, threadView))
+            for ident, (thread, threadView) in self._threads.items()
+            if threadView is not view
+        )
+        if not self._views:
+            stdout, stderr = self._originals
+            self._originals = None
+            # leave anything that was installed on top of the router alone
+            if isinstance(sys.stdout, PyREPLRoutedOutput):
+                sys.stdout = stdout
+            if isinstance(sys.stderr, PyREPLRoutedOutput):
+                sys.stderr = stderr
+
+    def runningThreads(self):
+        return set(threading.enumerate())
+
+    def adoptNewThreads(self, view, threadsBefore):
+        """
+        Send the output of the threads that were started
+        since threadsBefore was taken to view.
+        """
+        if view not in self._views:
+            return
+        threads = dict(
+            (ident, item) for ident, item in self._threads.items()
+            if item[0].is_alive()
+        )
+        for thread in threading.enumerate():
+            if thread not in threadsBefore:
+                threads[thread.ident] = (thread, view)
+        self._threads = threads
+
+    def getOutput(self, index):
+        """
+        Get the output of the window for the current thread
+        or None if the original stream should be used.
+        """
+        item = self._threads.get(threading.get_ident())
+        if item is None:
+            return None
+        thread, view = item
+        # idents are reused once a thread has finished
+        if thread is not threading.current_thread():
+            return None
+        return view.outputStreams()[index]
+
+
+class PyREPLRoutedOutput(object):
+
+    def __init__(self, router, original, index):
+        self._router = router
+        self._original = original
+        self._index = index
+
+    def write(self, s):
+        output = self._router.getOutput(self._index)
+        if output is None:
+            output = self._original
+        if output is not None:
+            output.write(s)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self._original is not None:
+            self._original.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._original, name)
+
+
+outputRouter = PyREPLOutputRouter()
+
+
 if __name__ == "__main__":
     from vanilla.test.testTools import executeVanillaTest
     executeVanillaTest(PyREPLWindow)
@@ -0,0 +1,133 @@
+"""
+Top-level await support.
+
+AsyncConsole compiles input with top-level await allowed.
+When the compiled code turns out to be a coroutine, it is
+run to completion on the console's event loop. The loop is
+kept between commands, so tasks created with
+asyncio.ensure_future or loop.create_task keep existing after
+the command that created them has finished. Something has
+to give those tasks time to run between commands. That is
+what runEventLoopOnce is for.
+
+This follows what python -m asyncio does.
+
+The console's loop is only the thread's current event loop
+while a command runs. Whatever was current before is put
+back afterwards, so that other asyncio users in RoboFont
+never find the console's loop, which is closed when the
+last window using it closes.
+"""
+
+import ast
+import sys
+import types
+import inspect
+import asyncio
+import traceback
+from code import InteractiveConsole
+
+
+class AsyncConsole(InteractiveConsole):
+
+    def __init__(self, locals=None, filename="<console>", loop=None):
+        super(AsyncConsole, self).__init__(locals=locals, filename=filename)
+        self.compile.compiler.flags |= ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+        if loop is None:
+            loop = newEventLoop()
+        self.loop = loop
+
+    def runcode(self, code):
+        # asyncio.ensure_future and asyncio.get_event_loop
+        # should find this loop. Code that calls asyncio.run
+        # unsets the current loop, so this is done every time.
+        previousLoop = getCurrentEventLoop()
+        asyncio.set_event_loop(self.loop)
+        func = types.FunctionType(code, self.locals)
+        try:
+            result = func()
+            if inspect.iscoroutine(result):
+                self.loop.run_until_complete(self._awaitResult(result))
+        except SystemExit:
+            raise
+        except BaseException:
+            self.showtraceback()
+        finally:
+            asyncio.set_event_loop(previousLoop)
+
+    async def _awaitResult(self, coroutine):
+        # Catching here keeps the asyncio internals out of the traceback.
+        try:
+            await coroutine
+        except SystemExit:
+            raise
+        except BaseException:
+            self.showtraceback()
+
+
+def getCurrentEventLoop():
+    """
+    Get the event loop that is set for the current
+    thread or None. Unlike asyncio.get_event_loop,
+    this never creates a loop.
+    """
+    policy = asyncio.get_event_loop_policy()
+    local = getattr(policy, "_local", None)
+    if local is not None:
+        return getattr(local, "_loop", None)
+    try:
+        return policy.get_event_loop()
+    except RuntimeError:
+        return None
+
+
+def newEventLoop():
+    loop = asyncio.new_event_loop()
+    loop.set_exception_handler(printLoopException)
+    return loop
+
+
+def printLoopException(loop, context):
+    """
+    Write exceptions from tasks and callbacks to sys.stderr,
+    which is the console's output while the loop runs, instead
+    of sending them to the logging module.
+    """
+    message = context.get("message", "Unhandled exception in event loop")
+    exception = context.get("exception")
+    if exception is None:
+        print(message, file=sys.stderr)
+    else:
+        print(message, file=sys.stderr)
+        traceback.print_exception(type(exception), exception, exception.__traceback__, file=sys.stderr)
+
+
+def runEventLoopOnce(loop):
+    """
+    Run everything that is ready to run on loop, once.
+    """
+    previousLoop = getCurrentEventLoop()
+    loop.call_soon(loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        asyncio.set_event_loop(previousLoop)
+
+
+def hasPendingTasks(loop):
+    return bool(asyncio.all_tasks(loop))
+
+
+def closeEventLoop(loop):
+    """
+    Cancel the pending tasks on loop and close it.
+    """
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+    if getCurrentEventLoop() is loop:
+        asyncio.set_event_loop(None)
@@ -0,0 +1,333 @@
+"""
+Size capped, lazy display of results.
+
+The default sys.displayhook calls repr() on the whole value
+and the console then writes that string into the text view.
+For things like a big kerning dict that can be megabytes of
+text. The tools in here build reprs piece by piece so that
+they can stop as soon as enough has been shown.
+"""
+
+import os
+import sys
+from collections import defaultdict, Counter, OrderedDict
+
+dictViewTypes = (
+    type({}.keys()),
+    type({}.values()),
+    type({}.items())
+)
+
+textTypeReprs = (
+    str.__repr__,
+    bytes.__repr__,
+    bytearray.__repr__
+)
+
+
+class LimitedRepr(object):
+
+    """
+    Builds reprs incrementally.
+
+    - maxItems : The number of items shown per container. None means no limit.
+    - maxDepth : The number of nested containers shown. None means no limit.
+    - maxLength : The number of characters shown in total. None means no limit.
+    """
+
+    def __init__(self, maxItems=100, maxDepth=4, maxLength=10000):
+        self.maxItems = maxItems
+        self.maxDepth = maxDepth
+        self.maxLength = maxLength
+
+    def repr(self, obj):
+        """
+        Get the capped repr for obj. Returns the text and
+        a bool indicating if anything was left out.
+        """
+        pieces = []
+        length = 0
+        truncated = False
+        maxLength = self.maxLength
+        for piece in self.iterRepr(obj):
+            if maxLength is not None and length + len(piece) > maxLength:
+                pieces.append(piece[:maxLength - length])
+                pieces.append("…")
+                truncated = True
+                break
+            pieces.append(piece)
+            length += len(piece)
+        text = "".join(pieces)
+        if self._omittedSomething:
+            truncated = True
+        return text, truncated
+
+    def iterRepr(self, obj):
+        """
+        Yield the repr of obj in pieces.
+        """
+        self._omittedSomething = False
+        return self._iterRepr(obj, 0, set())
+
+    def _iterRepr(self, obj, level, active):
+        typ = type(obj)
+        if typ in dictViewTypes:
+            opener = "%s([" % typ.__name__
+            closer = "])"
+            if typ is dictViewTypes[2]:
+                itemIterator = self._iterTupleItems
+            else:
+                itemIterator = self._iterValues
+        elif typ.__repr__ is list.__repr__:
+            opener, closer = "[", "]"
+            itemIterator = self._iterValues
+        elif typ.__repr__ is tuple.__repr__ and not hasattr(obj, "_fields"):
+            if len(obj) == 1:
+                opener, closer = "(", ",)"
+            else:
+                opener, closer = "(", ")"
+            itemIterator = self._iterValues
+        elif typ.__repr__ is dict.__repr__:
+            opener, closer = "{", "}"
+            itemIterator = self._iterDictItems
+        elif typ.__repr__ is defaultdict.__repr__:
+            opener = "%s(%r, {" % (typ.__name__, obj.default_factory)
+            closer = "})"
+            itemIterator = self._iterDictItems
+        elif typ.__repr__ is Counter.__repr__:
+            if not obj:
+                yield "%s()" % typ.__name__
+                return
+            opener = "%s({" % typ.__name__
+            closer = "})"
+            itemIterator = self._iterCounterItems
+        elif typ.__repr__ is OrderedDict.__repr__:
+            if not obj:
+                yield "%s()" % typ.__name__
+                return
+            if sys.version_info >= (3, 12):
+                opener = "%s({" % typ.__name__
+                closer = "})"
+                itemIterator = self._iterDictItems
+            else:
+                opener = "%s([" % typ.__name__
+                closer = "])"
+                itemIterator = self._iterDictTupleItems
+        elif typ.__repr__ is set.__repr__:
+            if not obj:
+                yield "set()"
+                return
+            opener, closer = "{", "}"
+            itemIterator = self._iterValues
+        elif typ.__repr__ is frozenset.__repr__:
+            if not obj:
+                yield "frozenset()"
+                return
+            opener, closer = "frozenset({", "})"
+            itemIterator = self._iterValues
+        elif typ.__repr__ in textTypeReprs:
+            # Only the start of a long string can be shown,
+            # so only the start goes through repr.
+            maxLength = self.maxLength
+            if maxLength is not None and len(obj) > maxLength:
+                self._omittedSomething = True
+                obj = obj[:maxLength]
+            yield typ.__repr__(obj)
+            return
+        else:
+            yield repr(obj)
+            return
+        objID = id(obj)
+        if objID in active:
+            yield opener + "..." + closer
+            return
+        if self.maxDepth is not None and level >= self.maxDepth:
+            self._omittedSomething = True
+            yield "%s… %s%s" % (opener, formatItemCount(len(obj)), closer)
+            return
+        active.add(objID)
+        try:
+            yield opener
+            maxItems = self.maxItems
+            for index, pieces in enumerate(itemIterator(obj, level + 1, active)):
+                if maxItems is not None and index >= maxItems:
+                    self._omittedSomething = True
+                    remaining = len(obj) - index
+                    yield ", … %s" % formatItemCount(remaining, "more ")
+                    break
+                if index:
+                    yield ", "
+                for piece in pieces:
+                    yield piece
+            yield closer
+        finally:
+            active.discard(objID)
+
+    def _iterValues(self, obj, level, active):
+        for value in obj:
+            yield self._iterRepr(value, level, active)
+
+    def _iterDictItems(self, obj, level, active):
+        for key, value in obj.items():
+            yield self._iterPair(key, ": ", value, level, active)
+
+    def _iterDictTupleItems(self, obj, level, active):
+        return self._iterTupleItems(obj.items(), level, active)
+
+    def _iterCounterItems(self, obj, level, active):
+        # like Counter.__repr__, most common first
+        try:
+            items = obj.most_common()
+        except TypeError:
+            items = obj.items()
+        for key, value in items:
+            yield self._iterPair(key, ": ", value, level, active)
+
+    def _iterTupleItems(self, obj, level, active):
+        for key, value in obj:
+            yield self._iterPair(key, ", ", value, level, active, "(", ")")
+
+    def _iterPair(self, key, separator, value, level, active, opener="", closer=""):
+        yield opener
+        for piece in self._iterRepr(key, level, active):
+            yield piece
+        yield separator
+        for piece in self._iterRepr(value, level, active):
+            yield piece
+        yield closer
+
+
+def formatItemCount(count, adjective=""):
+    if count == 1:
+        return "1 %sitem" % adjective
+    return "{:,} {}items".format(count, adjective)
+
+
+class ResultPager(object):
+
+    """
+    Pages through the complete repr of a value.
+
+    The repr is only built as far as it has been paged.
+    """
+
+    def __init__(self, value, pageLength):
+        self.value = value
+        self.pageLength = pageLength
+        self._pieces = LimitedRepr(None, None, None).iterRepr(value)
+        self._pending = ""
+        self._finished = False
+
+    def isFinished(self):
+        return self._finished and not self._pending
+
+    def skip(self, text):
+        """
+        Skip the start of the repr as far as it is the same
+        as text, which usually is what has already been shown.
+        """
+        pending = [self._pending]
+        length = len(self._pending)
+        while length < len(text) and not self._finished:
+            try:
+                piece = next(self._pieces)
+            except StopIteration:
+                self._finished = True
+                break
+            pending.append(piece)
+            length += len(piece)
+        available = "".join(pending)
+        count = len(os.path.commonprefix([available[:len(text)], text]))
+        self._pending = available[count:]
+
+    def nextPage(self):
+        """
+        Get the next page of text. Returns None when
+        there is nothing left.
+        """
+        pending = [self._pending]
+        length = len(self._pending)
+        while length < self.pageLength and not self._finished:
+            try:
+                piece = next(self._pieces)
+            except StopIteration:
+                self._finished = True
+                break
+            pending.append(piece)
+            length += len(piece)
+        text = "".join(pending)
+        if not text:
+            return None
+        self._pending = text[self.pageLength:]
+        return text[:self.pageLength]
+
+
+class DisplayHook(object):
+
+    """
+    A sys.displayhook replacement that shows capped reprs.
+
+    - namespace : The namespace that "_" should be stored in.
+    - makeFormatter : A callable that returns the LimitedRepr to use.
+    - history : An optional object with an add method that
+      will be given every displayed result.
+    """
+
+    def __init__(self, namespace, makeFormatter, history=None):
+        self.namespace = namespace
+        self.makeFormatter = makeFormatter
+        self.history = history
+        self.pager = None
+
+    def __call__(self, value):
+        if value is None:
+            return
+        self.namespace["_"] = value
+        if self.history is not None:
+            self.history.add(value)
+        self.display(value)
+
+    def display(self, value):
+        formatter = self.makeFormatter()
+        text, truncated = formatter.repr(value)
+        write = sys.stdout.write
+        write(text)
+        write("\n")
+        if truncated:
+            self.pager = ResultPager(value, formatter.maxLength or 10000)
+            if text.endswith("…"):
+                text = text[:-1]
+            self.pager.skip(text)
+            write("(Type more() to see more or show(_, all=True) to see everything.)\n")
+
+    def more(self, value=None):
+        """
+        Show the next page of the most recently truncated result.
+        If value is given, start paging through value instead.
+        """
+        if value is not None:
+            self.pager = ResultPager(value, self.makeFormatter().maxLength or 10000)
+        if self.pager is None or self.pager.isFinished():
+            print("Nothing more to show.")
+            return
+        text = self.pager.nextPage()
+        if text is not None:
+            sys.stdout.write(text)
+        if self.pager.isFinished():
+            sys.stdout.write("\n")
+        else:
+            sys.stdout.write("…\n")
+
+    def show(self, value, all=False):
+        """
+        Show value. If all is True, the complete repr is
+        written in pieces, otherwise it is capped the same
+        way results are.
+        """
+        if not all:
+            self.display(value)
+            return
+        write = sys.stdout.write
+        for piece in LimitedRepr(None, None, None).iterRepr(value):
+            write(piece)
+        write("\n")
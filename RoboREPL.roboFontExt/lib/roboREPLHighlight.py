@@ -0,0 +1,217 @@
+"""
+Incremental syntax highlighting for the input region.
+
+Only the text after the prompt is highlighted. It is split
+into lines and each line is tokenized with tokenize on its
+own, starting from the state the previous line ended in.
+The only state that matters for coloring is whether the line
+starts inside a triple quoted string. For every line the text,
+the start state, the end state and the colored runs are cached.
+When the input changes, lines are only tokenized from the first
+changed line and only until a line is reached that is unchanged
+and starts in the same state as before.
+
+Lines of a multi-line block that have already been sent to the
+console are kept with their end states so that the input region
+starts in the right state.
+"""
+
+import io
+import re
+import keyword
+import tokenize
+from roboREPLSelection import utf16Offsets
+
+stringTokenTypes = set([tokenize.STRING])
+for name in ("FSTRING_START", "FSTRING_MIDDLE", "FSTRING_END"):
+    if hasattr(tokenize, name):
+        stringTokenTypes.add(getattr(tokenize, name))
+
+tripleQuoteStartRE = re.compile(r"[rRbBuUfF]{0,2}(\"\"\"|''')")
+singleQuoteStartRE = re.compile(r"[rRbBuUfF]{0,2}[\"']")
+
+
+class HighlightedLine(object):
+
+    __slots__ = ("text", "startState", "endState", "runs")
+
+    def __init__(self, text, startState, endState, runs):
+        self.text = text
+        self.startState = startState
+        self.endState = endState
+        self.runs = runs
+
+
+def tokenizeLine(text, state):
+    """
+    Get the colored runs in text and the state at the end of it.
+    state is None or the triple quote that the line starts inside of.
+    Runs are (start, length, kind) with kind being one of "keyword",
+    "string", "number" or "comment".
+    """
+    runs = []
+    offset = 0
+    if state is not None:
+        end = findClosingQuote(text, 0, state)
+        if end is None:
+            if text:
+                runs.append((0, len(text), "string"))
+            return runs, state
+        runs.append((0, end, "string"))
+        offset = end
+    remainder = text[offset:]
+    position = 0
+    try:
+        readline = io.StringIO(remainder).readline
+        for token in tokenize.generate_tokens(readline):
+            tokenType = token.type
+            (startRow, startColumn), (endRow, endColumn) = token.start, token.end
+            if startRow != 1:
+                break
+            if endRow != 1:
+                endColumn = len(remainder)
+            if tokenType == tokenize.ERRORTOKEN:
+                # unterminated single quoted strings show up as errors
+                if singleQuoteStartRE.match(remainder, startColumn):
+                    runs.append((offset + startColumn, len(remainder) - startColumn, "string"))
+                    return runs, None
+                continue
+            kind = None
+            if tokenType == tokenize.NAME:
+                if keyword.iskeyword(token.string):
+                    kind = "keyword"
+            elif tokenType in stringTokenTypes:
+                kind = "string"
+            elif tokenType == tokenize.NUMBER:
+                kind = "number"
+            elif tokenType == tokenize.COMMENT:
+                kind = "comment"
+            position = endColumn
+            if kind is not None and endColumn > startColumn:
+                runs.append((offset + startColumn, endColumn - startColumn, kind))
+    except (tokenize.TokenError, SyntaxError, IndentationError):
+        pass
+    # Look for what tokenize gave up on: the start of a triple
+    # quoted string that continues on the next line or a single
+    # quoted string that is never closed.
+    match = tripleQuoteStartRE.search(remainder, position)
+    if match is not None and findClosingQuote(remainder, match.end(), match.group(1)) is None:
+        start = match.start()
+        runs.append((offset + start, len(remainder) - start, "string"))
+        return runs, match.group(1)
+    match = singleQuoteStartRE.search(remainder, position)
+    if match is not None:
+        start = match.start()
+        runs.append((offset + start, len(remainder) - start, "string"))
+    return runs, None
+
+
+def findClosingQuote(text, start, quote):
+    """
+    Get the index after the closing quote or None.
+    """
+    index = start
+    while True:
+        index = text.find(quote, index)
+        if index == -1:
+            return None
+        backslashes = 0
+        i = index - 1
+        while i >= start and text[i] == "\\":
+            backslashes += 1
+            i -= 1
+        if backslashes % 2 == 0:
+            return index + len(quote)
+        index += 1
+
+
+class InputHighlighter(object):
+
+    def __init__(self):
+        self._blockStates = []
+        self._lines = []
+
+    # Block
+
+    def _get_regionStartState(self):
+        if self._blockStates:
+            return self._blockStates[-1]
+        return None
+
+    regionStartState = property(_get_regionStartState)
+
+    def pushBlockLine(self, text):
+        """
+        Record a line of a multi-line block that has been sent to the console.
+        """
+        runs, state = tokenizeLine(text, self.regionStartState)
+        self._blockStates.append(state)
+        self._lines = []
+
+    def resetBlock(self):
+        self._blockStates = []
+        self._lines = []
+
+    # Region
+
+    def update(self, text):
+        """
+        Update the cache for the new input region text.
+        Returns the start and end of the range that needs to
+        be recolored and the runs within that range. All
+        offsets are relative to the start of the region and
+        in UTF-16 code units, like NSString ranges.
+        """
+        newTexts = text.split("\n")
+        oldLines = self._lines
+        oldCount = len(oldLines)
+        newCount = len(newTexts)
+        # unchanged lines at the start
+        prefix = 0
+        while prefix < oldCount and prefix < newCount and oldLines[prefix].text == newTexts[prefix]:
+            prefix += 1
+        if prefix == oldCount == newCount:
+            return 0, 0, []
+        # unchanged lines at the end
+        suffix = 0
+        while suffix < oldCount - prefix and suffix < newCount - prefix and oldLines[oldCount - 1 - suffix].text == newTexts[newCount - 1 - suffix]:
+            suffix += 1
+        newLines = oldLines[:prefix]
+        if prefix:
+            state = oldLines[prefix - 1].endState
+        else:
+            state = self.regionStartState
+        startOffset = sum(len(line) + 1 for line in newTexts[:prefix])
+        offset = startOffset
+        runs = []
+        index = prefix
+        changedEnd = newCount - suffix
+        while index < newCount:
+            lineText = newTexts[index]
+            if index >= changedEnd:
+                old = oldLines[oldCount - (newCount - index)]
+                if old.startState == state:
+                    # from here on nothing changes
+                    newLines.extend(oldLines[oldCount - (newCount - index):])
+                    break
+            lineRuns, endState = tokenizeLine(lineText, state)
+            newLines.append(HighlightedLine(lineText, state, endState, lineRuns))
+            for start, length, kind in lineRuns:
+                runs.append((offset + start, length, kind))
+            offset += len(lineText) + 1
+            state = endState
+            index += 1
+        self._lines = newLines
+        endOffset = min(offset, len(text))
+        if not text.isascii():
+            offsets = utf16Offsets(text)
+            runs = [
+                (offsets[start], offsets[start + length] - offsets[start], kind)
+                for start, length, kind in runs
+            ]
+            startOffset = offsets[startOffset]
+            endOffset = offsets[endOffset]
+        return startOffset, endOffset, runs
+
+    def clear(self):
+        self._lines = []
@@ -0,0 +1,176 @@
+"""
+Numbered result history.
+
+Every displayed result gets a number. The result can then be
+retrieved as _1, _2 and so on or as Out[1], Out[2] and so on.
+The history is bounded by the number of results it holds and
+by the estimated memory of the results it holds. When either
+is exceeded, the least recently used results are dropped.
+"""
+
+import weakref
+from collections import OrderedDict
+from roboREPLMemory import deepSizeOf, formatByteSize
+from roboREPLDisplay import LimitedRepr
+
+sizeEstimateTimeBudget = 0.05
+
+
+class ResultHistoryEntry(object):
+
+    __slots__ = ("number", "typeName", "size", "sizeIsComplete", "_value", "_ref")
+
+    def __init__(self, number, value, size, sizeIsComplete, weak):
+        self.number = number
+        self.typeName = type(value).__name__
+        self.size = size
+        self.sizeIsComplete = sizeIsComplete
+        if weak:
+            self._value = None
+            self._ref = weakref.ref(value)
+        else:
+            self._value = value
+            self._ref = None
+
+    def isWeak(self):
+        return self._ref is not None
+
+    def isAlive(self):
+        if self._ref is None:
+            return True
+        return self._ref() is not None
+
+    def getValue(self):
+        if self._ref is None:
+            return self._value
+        return self._ref()
+
+
+class ResultHistory(object):
+
+    """
+    - namespace : The namespace that _1, _2, etc. should be stored in.
+    - getLimits : A callable that returns the maximum number of results,
+      the maximum estimated size of the results held strongly and the
+      size at which results are held weakly, if possible. A weak
+      threshold of 0 means results are never held weakly. Weakly held
+      results are only available through Out.
+    """
+
+    def __init__(self, namespace, getLimits):
+        self.namespace = namespace
+        self.getLimits = getLimits
+        self._entries = OrderedDict()
+        self._counter = 0
+        self._strongBytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, number):
+        entry = self._entries.get(number)
+        return entry is not None and entry.isAlive()
+
+    def __getitem__(self, number):
+        entry = self._entries.get(number)
+        if entry is None:
+            raise KeyError("Result %r is not in the history." % number)
+        value = entry.getValue()
+        if value is None and entry.isWeak():
+            raise KeyError("Result %r has been garbage collected." % number)
+        self._entries.move_to_end(number)
+        return value
+
+    def keys(self):
+        return [number for number, entry in self._entries.items() if entry.isAlive()]
+
+    def __repr__(self):
+        return "<Result History: %d results, %s held. Type \"%%results\" for details.>" % (len(self), formatByteSize(self._strongBytes))
+
+    def add(self, value):
+        """
+        Add value to the history and return its number.
+        """
+        maxCount, maxBytes, weakThreshold = self.getLimits()
+        self._counter += 1
+        number = self._counter
+        size, complete = deepSizeOf(value, timeBudget=sizeEstimateTimeBudget)
+        weak = False
+        if weakThreshold and size >= weakThreshold:
+            try:
+                weakref.ref(value)
+                weak = True
+            except TypeError:
+                pass
+        entry = ResultHistoryEntry(number, value, size, complete, weak)
+        self._entries[number] = entry
+        if not weak:
+            self._strongBytes += size
+            self.namespace["_%d" % number] = value
+        self._trim(maxCount, maxBytes)
+        return number
+
+    def _trim(self, maxCount, maxBytes):
+        # collected weak results shouldn't push out live ones
+        for number, entry in list(self._entries.items()):
+            if not entry.isAlive():
+                self._remove(number)
+        while len(self._entries) > 1:
+            if len(self._entries) <= maxCount and self._strongBytes <= maxBytes:
+                break
+            number = next(iter(self._entries))
+            self._remove(number)
+
+    def _remove(self, number):
+        entry = self._entries.pop(number)
+        if not entry.isWeak():
+            self._strongBytes -= entry.size
+            name = "_%d" % number
+            if self.namespace.get(name) is entry.getValue():
+                del self.namespace[name]
+
+    def clear(self):
+        for number in list(self._entries):
+            self._remove(number)
+
+    def report(self):
+        """
+        Print the number, type, estimated size and
+        storage of every result in the history.
+        """
+        if not self._entries:
+            print("The result history is empty.")
+            return
+        formatter = LimitedRepr(maxItems=5, maxDepth=1, maxLength=40)
+        rows = [("Number", "Type", "Size", "Held", "Value")]
+        for number, entry in self._entries.items():
+            size = formatByteSize(entry.size)
+            if not entry.sizeIsComplete:
+                size = ">" + size
+            value = entry.getValue()
+            if not entry.isWeak():
+                held = "strong"
+            elif value is None:
+                held = "collected"
+            else:
+                held = "weak"
+            if value is None and entry.isWeak():
+                preview = ""
+            else:
+                preview = formatter.repr(value)[0].replace("\n", " ")
+            if entry.isWeak():
+                # weak results have no _N name
+                name = "Out[%d]" % number
+            else:
+                name = "_%d" % number
+            rows.append((name, entry.typeName, size, held, preview))
+        widths = [max(len(row[i]) for row in rows) for i in range(4)]
+        for row in rows:
+            print("  ".join([cell.ljust(width) for cell, width in zip(row, widths)] + [row[-1]]).rstrip())
+        maxCount, maxBytes, weakThreshold = self.getLimits()
+        print("%d results. %s held in memory (limit: %d results, %s)." % (
+            len(self._entries),
+            formatByteSize(self._strongBytes),
+            maxCount,
+            formatByteSize(maxBytes)
+        ))
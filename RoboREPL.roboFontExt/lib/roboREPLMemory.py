@@ -0,0 +1,216 @@
+"""
+Memory estimation for values in the console namespace.
+
+Sizes are estimates. They are the sum of sys.getsizeof
+for everything reachable from a value, not counting
+modules, classes and functions, which are shared by
+everything and would make every estimate huge.
+"""
+
+import sys
+import gc
+import time
+import types
+
+unsizedTypes = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    types.CodeType,
+    types.FrameType
+)
+
+
+def deepSizeOf(obj, timeBudget=None, seen=None):
+    """
+    Estimate the number of bytes used by obj and
+    everything it refers to.
+
+    - timeBudget : The maximum number of seconds to spend. None means no limit.
+    - seen : A set of ids that should not be counted. This will be updated.
+
+    Returns the size and a bool indicating if the
+    traversal was completed within the time budget.
+    """
+    if seen is None:
+        seen = set()
+    if timeBudget is not None:
+        deadline = time.perf_counter() + timeBudget
+    getsizeof = sys.getsizeof
+    getReferents = gc.get_referents
+    size = 0
+    stack = [obj]
+    count = 0
+    while stack:
+        o = stack.pop()
+        oID = id(o)
+        if oID in seen:
+            continue
+        seen.add(oID)
+        if isinstance(o, unsizedTypes):
+            continue
+        try:
+            size += getsizeof(o)
+        except TypeError:
+            continue
+        stack.extend(getReferents(o))
+        count += 1
+        if timeBudget is not None and not count % 1000:
+            if time.perf_counter() > deadline:
+                return size, False
+    return size, True
+
+
+def formatByteSize(size):
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024.0
+    if unit == "bytes":
+        return "%d bytes" % size
+    return "%.1f %s" % (size, unit)
+
+
+# ---------
+# Namespace
+# ---------
+
+def findReferrers(values, ignore=()):
+    """
+    Find the containers that refer to values with a
+    single pass over the objects tracked by gc.
+
+    - ignore : Containers that should not be reported.
+
+    Returns a dict of value id : list of referrers.
+    """
+    ignoreIDs = set(id(o) for o in ignore)
+    ignoreIDs.add(id(values))
+    valueIDs = set(id(v) for v in values)
+    found = dict((valueID, []) for valueID in valueIDs)
+    frame = sys._getframe()
+    ignoreIDs.add(id(frame))
+    for referrer in gc.get_referrers(*values):
+        if id(referrer) in ignoreIDs:
+            continue
+        if isinstance(referrer, types.FrameType):
+            continue
+        for referent in gc.get_referents(referrer):
+            referentID = id(referent)
+            if referentID in valueIDs:
+                found[referentID].append(referrer)
+    del frame
+    return found
+
+
+def describeReferrer(referrer, moduleDicts):
+    referrerID = id(referrer)
+    if referrerID in moduleDicts:
+        return "module %s" % moduleDicts[referrerID]
+    typeName = type(referrer).__name__
+    if isinstance(referrer, (dict, list, tuple, set)):
+        return "%s of %d" % (typeName, len(referrer))
+    return typeName
+
+
+def getModuleDicts():
+    moduleDicts = {}
+    for name, module in list(sys.modules.items()):
+        moduleDict = getattr(module, "__dict__", None)
+        if moduleDict is not None:
+            moduleDicts[id(moduleDict)] = name
+    return moduleDicts
+
+
+def printTable(rows):
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+
+def whos(namespace, names, showReferrers=False, timeBudget=5.0):
+    """
+    Print the type and the shallow and deep estimated
+    size of the given names in namespace, largest first.
+    If the time budget is exhausted, the remaining deep
+    sizes are not computed. If showReferrers is True,
+    the other containers referring to each value are
+    listed as well.
+    """
+    if not names:
+        print("Nothing to show.")
+        return
+    deadline = time.perf_counter() + timeBudget
+    entries = []
+    for name in names:
+        value = namespace[name]
+        remaining = deadline - time.perf_counter()
+        if remaining > 0:
+            deep, complete = deepSizeOf(value, timeBudget=remaining)
+        else:
+            deep = complete = None
+        entries.append((name, value, deep, complete))
+    entries.sort(key=lambda entry: (-(entry[2] or 0), entry[0]))
+    header = ["Name", "Type", "Shallow", "Deep"]
+    if showReferrers:
+        header.append("Also Held By")
+        values = [entry[1] for entry in entries]
+        referrers = findReferrers(values, ignore=[namespace, entries] + entries)
+        moduleDicts = getModuleDicts()
+        aliases = {}
+        for name, value in namespace.items():
+            aliases.setdefault(id(value), []).append(name)
+    rows = [header]
+    totalDeep = 0
+    for name, value, deep, complete in entries:
+        try:
+            shallow = formatByteSize(sys.getsizeof(value))
+        except TypeError:
+            shallow = "?"
+        if deep is None:
+            deepText = "?"
+        else:
+            totalDeep += deep
+            deepText = formatByteSize(deep)
+            if not complete:
+                deepText = ">" + deepText
+        row = [name, type(value).__name__, shallow, deepText]
+        if showReferrers:
+            holders = [alias for alias in aliases[id(value)] if alias != name]
+            holders += [describeReferrer(referrer, moduleDicts) for referrer in referrers[id(value)]]
+            if len(holders) > 5:
+                holders = holders[:5] + ["%d more" % (len(holders) - 5)]
+            row.append(", ".join(holders))
+        rows.append(row)
+    printTable(rows)
+    print("%d names. %s estimated in total. Objects shared between names are counted for each." % (len(entries), formatByteSize(totalDeep)))
+
+
+def reset(namespace, names):
+    """
+    Remove the given names from namespace and report
+    the estimated memory that was reclaimed.
+    """
+    if not names:
+        print("Nothing to remove.")
+        return
+    values = [namespace[name] for name in names]
+    seen = set()
+    sizes = [deepSizeOf(value, timeBudget=1.0, seen=seen)[0] for value in values]
+    for name in names:
+        del namespace[name]
+    collected = gc.collect()
+    referrers = findReferrers(values)
+    reclaimed = 0
+    retained = []
+    for name, value, size in zip(names, values, sizes):
+        if referrers[id(value)]:
+            retained.append(name)
+        else:
+            reclaimed += size
+    del values
+    print("Removed %d names. Estimated reclaimed: %s. Unreachable objects collected: %d." % (len(names), formatByteSize(reclaimed), collected))
+    if retained:
+        print("Still referenced elsewhere: %s" % ", ".join(retained))
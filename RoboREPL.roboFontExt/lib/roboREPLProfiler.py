@@ -0,0 +1,197 @@
+"""
+A low overhead sampling profiler.
+
+A helper thread looks at the stack of the profiled thread
+at a regular interval and counts how often each stack is
+seen. Nothing is done in the profiled thread itself, so
+tight loops are not slowed down the way they are by
+deterministic profilers like cProfile.
+"""
+
+import sys
+import time
+import json
+import threading
+from collections import Counter
+
+consoleFilename = "<console>"
+
+# Shorter intervals make the sampler fight the sampled
+# code for the GIL instead of measuring it.
+minimumSampleInterval = 0.0001
+
+
+class SamplingProfiler(object):
+
+    """
+    - threadID : The ident of the thread to sample. Defaults to the current thread.
+    - interval : The number of seconds between samples.
+    - rootFilename : Frames outside of the outermost frame with this
+      filename are left out. Samples that don't contain a frame with
+      this filename are ignored. None keeps complete stacks.
+
+    The profiler can be started and stopped several times.
+    The samples are accumulated.
+    """
+
+    def __init__(self, threadID=None, interval=0.001, rootFilename=consoleFilename):
+        if threadID is None:
+            threadID = threading.get_ident()
+        self.threadID = threadID
+        self.interval = max(interval, minimumSampleInterval)
+        self.rootFilename = rootFilename
+        self.stacks = Counter()
+        self.sampleCount = 0
+        self.duration = 0
+        self._thread = None
+        self._stopEvent = None
+        self._startTime = None
+        self._switchInterval = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def isRunning(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        # The sampling thread can only run when the profiled
+        # thread gives up the GIL, which it does every switch
+        # interval. Shorten that so the requested rate is met.
+        self._switchInterval = sys.getswitchinterval()
+        if self.interval < self._switchInterval:
+            sys.setswitchinterval(self.interval)
+        self._stopEvent = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="RoboREPL Sampler")
+        self._thread.daemon = True
+        self._startTime = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopEvent.set()
+        self._thread.join()
+        self.duration += time.perf_counter() - self._startTime
+        sys.setswitchinterval(self._switchInterval)
+        self._thread = None
+        self._stopEvent = None
+
+    def _run(self):
+        threadID = self.threadID
+        interval = self.interval
+        rootFilename = self.rootFilename
+        stacks = self.stacks
+        wait = self._stopEvent.wait
+        getFrames = sys._current_frames
+        while not wait(interval):
+            frame = getFrames().get(threadID)
+            if frame is None:
+                break
+            stack = []
+            rootIndex = None
+            while frame is not None:
+                code = frame.f_code
+                if code.co_filename == rootFilename:
+                    rootIndex = len(stack)
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            frame = None
+            if rootFilename is not None:
+                if rootIndex is None:
+                    continue
+                del stack[rootIndex + 1:]
+            stack.reverse()
+            stacks[tuple(stack)] += 1
+            self.sampleCount += 1
+
+    # Summary
+
+    def getFunctionCounts(self):
+        """
+        Get the number of samples in which each function
+        was executing (self) and was on the stack (total).
+        """
+        selfCounts = Counter()
+        totalCounts = Counter()
+        for stack, count in self.stacks.items():
+            selfCounts[stack[-1]] += count
+            for key in set(stack):
+                totalCounts[key] += count
+        return selfCounts, totalCounts
+
+    def printSummary(self, count=20):
+        if not self.sampleCount:
+            print("No samples were collected.")
+            return
+        selfCounts, totalCounts = self.getFunctionCounts()
+        total = float(self.sampleCount)
+        print("%d samples in %.3f seconds (%.0f samples/second)." % (self.sampleCount, self.duration, self.sampleCount / max(self.duration, 1e-9)))
+        print("%7s %7s  %s" % ("Self", "Total", "Function"))
+        for key, selfCount in selfCounts.most_common(count):
+            print("%6.1f%% %6.1f%%  %s" % (100 * selfCount / total, 100 * totalCounts[key] / total, formatFrame(key)))
+
+    # Export
+
+    def writeCollapsed(self, path):
+        """
+        Write the stacks in the collapsed format used
+        by flamegraph.pl and compatible tools.
+        """
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write("%s %d\n" % (";".join(formatFrame(key) for key in stack), count))
+
+    def writeSpeedscope(self, path, name="RoboREPL"):
+        """
+        Write the stacks as a speedscope sampled profile.
+        """
+        frames = []
+        frameIndexes = {}
+        samples = []
+        weights = []
+        if self.sampleCount:
+            weight = self.duration / self.sampleCount
+        else:
+            weight = 0
+        for stack, count in self.stacks.items():
+            sample = []
+            for key in stack:
+                if key not in frameIndexes:
+                    frameIndexes[key] = len(frames)
+                    functionName, fileName, line = key
+                    frames.append(dict(name=functionName, file=fileName, line=line))
+                sample.append(frameIndexes[key])
+            samples.append(sample)
+            weights.append(count * weight)
+        document = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "RoboREPL",
+            "activeProfileIndex": 0,
+            "shared": dict(frames=frames),
+            "profiles": [
+                dict(
+                    type="sampled",
+                    name=name,
+                    unit="seconds",
+                    startValue=0,
+                    endValue=sum(weights),
+                    samples=samples,
+                    weights=weights
+                )
+            ]
+        }
+        with open(path, "w") as f:
+            json.dump(document, f)
+
+
+def formatFrame(key):
+    functionName, fileName, line = key
+    return "%s (%s:%d)" % (functionName, fileName, line)
@@ -0,0 +1,206 @@
+"""
+Automatic reloading of changed modules.
+
+The reloader keeps an index of the imported modules that
+look like user code (not part of Python, installed packages
+or an application bundle) along with the modification time
+of their files and the indexed modules they import from.
+Checking for changes is one os.stat per indexed file.
+When files have changed, the changed modules and every module
+that depends on them are reloaded, dependencies first.
+"""
+
+import os
+import sys
+import time
+import types
+import importlib
+import traceback
+
+libDirectory = os.path.dirname(os.path.abspath(__file__))
+
+
+def getSystemDirectories():
+    directories = set()
+    for path in (sys.prefix, sys.exec_prefix, getattr(sys, "base_prefix", None), getattr(sys, "base_exec_prefix", None)):
+        if path:
+            directories.add(os.path.abspath(path) + os.sep)
+    return tuple(directories)
+
+
+def isUserModulePath(path, systemDirectories):
+    if not path.endswith(".py"):
+        return False
+    path = os.path.abspath(path)
+    if path.startswith(systemDirectories):
+        return False
+    if os.path.dirname(path) == libDirectory:
+        return False
+    for marker in ("site-packages", "dist-packages", ".app" + os.sep + "Contents"):
+        if marker in path:
+            return False
+    return True
+
+
+class ModuleReloader(object):
+
+    def __init__(self):
+        self._systemDirectories = getSystemDirectories()
+        self._moduleCount = 0
+        self._ignored = set(["__main__"])
+        # name : (path, mtime)
+        self._index = {}
+        # name : set of indexed module names that name imports from
+        self._dependencies = {}
+
+    def moduleNames(self):
+        return sorted(self._index)
+
+    # Index
+
+    def update(self):
+        """
+        Index modules that have been imported since the last update.
+        """
+        if len(sys.modules) == self._moduleCount:
+            return
+        self._moduleCount = len(sys.modules)
+        added = []
+        for name, module in list(sys.modules.items()):
+            if name in self._index or name in self._ignored:
+                continue
+            path = getattr(module, "__file__", None)
+            if not path or not isUserModulePath(path, self._systemDirectories):
+                self._ignored.add(name)
+                continue
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                self._ignored.add(name)
+                continue
+            self._index[name] = (path, mtime)
+            added.append(name)
+        if added:
+            for name in self._index:
+                self._dependencies[name] = self._findDependencies(name)
+
+    def _findDependencies(self, name):
+        module = sys.modules.get(name)
+        dependencies = set()
+        if module is None:
+            return dependencies
+        for value in list(vars(module).values()):
+            if isinstance(value, types.ModuleType):
+                dependency = value.__name__
+            else:
+                dependency = getattr(value, "__module__", None)
+            if dependency != name and dependency in self._index:
+                dependencies.add(dependency)
+        return dependencies
+
+    # Changes
+
+    def findChanged(self):
+        """
+        Get the names of the indexed modules whose
+        files have changed since they were indexed.
+        """
+        self.update()
+        stat = os.stat
+        changed = []
+        for name, (path, mtime) in self._index.items():
+            try:
+                newMTime = stat(path).st_mtime_ns
+            except OSError:
+                continue
+            if newMTime != mtime:
+                changed.append(name)
+        return changed
+
+    def getReloadOrder(self, changed):
+        """
+        Get the changed modules and all modules that
+        depend on them, sorted so that every module
+        comes after the modules it depends on.
+        """
+        dependents = {}
+        for name, dependencies in self._dependencies.items():
+            for dependency in dependencies:
+                dependents.setdefault(dependency, set()).add(name)
+        affected = set()
+        stack = list(changed)
+        while stack:
+            name = stack.pop()
+            if name in affected:
+                continue
+            affected.add(name)
+            stack.extend(dependents.get(name, ()))
+        order = []
+        visited = set()
+        def visit(name):
+            if name in visited:
+                return
+            visited.add(name)
+            for dependency in sorted(self._dependencies.get(name, ())):
+                if dependency in affected:
+                    visit(dependency)
+            order.append(name)
+        for name in sorted(affected):
+            visit(name)
+        return order
+
+    # Reload
+
+    def reloadChanged(self, namespace=None):
+        """
+        Reload the changed modules and the modules depending
+        on them. Names in namespace that were bound to functions
+        or classes from a reloaded module are rebound to the new
+        versions. Returns the reloaded module names and the
+        number of seconds it took. Nothing is done when no files
+        have changed.
+        """
+        changed = self.findChanged()
+        if not changed:
+            return [], 0
+        start = time.perf_counter()
+        reloaded = []
+        for name in self.getReloadOrder(changed):
+            module = sys.modules.get(name)
+            path = self._index[name][0]
+            if module is None:
+                del self._index[name]
+                continue
+            oldValues = dict(vars(module))
+            try:
+                importlib.reload(module)
+            except Exception:
+                traceback.print_exc()
+            else:
+                reloaded.append(name)
+                if namespace is not None:
+                    self._rebind(namespace, name, oldValues, vars(module))
+            try:
+                self._index[name] = (path, os.stat(path).st_mtime_ns)
+            except OSError:
+                del self._index[name]
+        for name in reloaded:
+            self._dependencies[name] = self._findDependencies(name)
+        return reloaded, time.perf_counter() - start
+
+    def _rebind(self, namespace, moduleName, oldValues, newValues):
+        replacements = {}
+        for key, old in oldValues.items():
+            if getattr(old, "__module__", None) != moduleName:
+                continue
+            if not isinstance(old, (type, types.FunctionType)):
+                continue
+            new = newValues.get(key)
+            if new is not None:
+                replacements[id(old)] = (old, new)
+        if not replacements:
+            return
+        for key, value in list(namespace.items()):
+            replacement = replacements.get(id(value))
+            if replacement is not None and replacement[0] is value:
+                namespace[key] = replacement[1]
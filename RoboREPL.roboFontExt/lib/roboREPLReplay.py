@@ -0,0 +1,394 @@
+"""
+Session recording and headless replay.
+
+SessionRecorder collects the blocks of code that are executed
+in a console, each with the time it took and the amount of
+output it wrote, and saves them to a JSON file along with the
+startup code and the paths of the fonts that were open when
+the recording started.
+
+The replay runner executes a recording again, outside of
+RoboFont, and compares the time each block takes with the
+recorded time. CurrentFont, AllFonts, OpenFont and NewFont
+give fontParts fonts backed by defcon (fontParts.fontshell),
+which have the same API as the fonts in RoboFont. There is
+no glyph window, so CurrentGlyph always returns None. The
+settings object is a stand-in that ignores everything, so
+startup code that changes settings still runs. Errors in the
+startup code are printed and noted in the report. Commands
+that raise an exception are reported as failed and are left
+out of the totals:
+
+    python roboREPLReplay.py recording.json [--font path.ufo] [--repeat n] [--threshold percent]
+
+This module must not import roboREPL or AppKit.
+"""
+
+import sys
+import json
+import time
+import platform
+import argparse
+import traceback
+from roboREPLAsync import AsyncConsole, closeEventLoop
+from roboREPLDisplay import DisplayHook, LimitedRepr
+from roboREPLHistory import ResultHistory
+
+recordingFormatVersion = 1
+# recordings made before the history limits were recorded
+defaultHistoryLimits = (50, 256 * 1024 * 1024, 0)
+
+
+class RecordingError(Exception): pass
+
+
+# ---------
+# Recording
+# ---------
+
+class SessionRecorder(object):
+
+    """
+    - path : The JSON file the recording is saved to.
+    - startupCode : The startup code of the recorded kernel.
+    - fontPaths : The paths of the open fonts, current font first.
+    - resultLimits : The (maxItems, maxDepth, maxLength) used for results.
+    - historyLimits : The (size, maxBytes, weakThreshold) of the result history.
+    """
+
+    def __init__(self, path, startupCode=None, fontPaths=(), resultLimits=(100, 4, 10000), historyLimits=defaultHistoryLimits):
+        self.path = path
+        self.startupCode = startupCode
+        self.fontPaths = list(fontPaths)
+        self.resultLimits = tuple(resultLimits)
+        self.historyLimits = tuple(historyLimits)
+        self.created = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.commands = []
+        # console : [lines, seconds, outputLength]
+        self._pending = {}
+
+    def addLine(self, console, line, seconds, outputLength, more):
+        """
+        Record a line that was pushed to console. Lines are
+        collected until the console no longer asks for more,
+        at which point they are recorded as one command.
+        """
+        pending = self._pending.setdefault(console, [[], 0.0, 0])
+        pending[0].append(line)
+        pending[1] += seconds
+        pending[2] += outputLength
+        if not more:
+            del self._pending[console]
+            lines, seconds, outputLength = pending
+            self.commands.append(dict(
+                source="\n".join(lines),
+                seconds=seconds,
+                outputLength=outputLength
+            ))
+
+    def save(self):
+        data = dict(
+            format=recordingFormatVersion,
+            created=self.created,
+            python=platform.python_version(),
+            platform=platform.platform(),
+            startupCode=self.startupCode,
+            fonts=self.fontPaths,
+            resultLimits=list(self.resultLimits),
+            historyLimits=list(self.historyLimits),
+            commands=self.commands
+        )
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1, ensure_ascii=False)
+
+
+def loadRecording(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise RecordingError("Could not read the recording at %s: %s" % (path, e))
+    if not isinstance(data, dict) or data.get("format") != recordingFormatVersion:
+        raise RecordingError("%s is not a RoboREPL recording this version can replay." % path)
+    return data
+
+
+# -----
+# Fonts
+# -----
+
+class ReplayFonts(object):
+
+    """
+    Stand-ins for the RoboFont font functions, giving
+    fontParts fonts backed by defcon. The first font in
+    the list is the current font.
+    """
+
+    def __init__(self, paths=()):
+        self.fonts = [self._openFont(path) for path in paths]
+
+    def _openFont(self, path=None):
+        # fontParts is only needed for recordings that use fonts
+        from fontParts.fontshell import RFont
+        return RFont(path, showInterface=False)
+
+    def CurrentFont(self):
+        if self.fonts:
+            return self.fonts[0]
+        return None
+
+    def CurrentGlyph(self):
+        """
+        There is no glyph window during a replay,
+        so there never is a current glyph.
+        """
+        return None
+
+    def AllFonts(self):
+        return list(self.fonts)
+
+    def OpenFont(self, path=None, showInterface=True):
+        if path is None:
+            raise RecordingError("OpenFont needs a path during a replay.")
+        font = self._openFont(path)
+        self.fonts.insert(0, font)
+        return font
+
+    def NewFont(self, familyName=None, styleName=None, showInterface=True):
+        font = self._openFont()
+        font.info.familyName = familyName
+        font.info.styleName = styleName
+        self.fonts.insert(0, font)
+        return font
+
+    def namespace(self):
+        return dict(
+            AllFonts=self.AllFonts,
+            CurrentFont=self.CurrentFont,
+            CurrentGlyph=self.CurrentGlyph,
+            OpenFont=self.OpenFont,
+            NewFont=self.NewFont
+        )
+
+
+# ------
+# Replay
+# ------
+
+class ReplayConsole(AsyncConsole):
+
+    """
+    Remembers the last exception that was shown, so that
+    commands that fail during a replay can be reported.
+    """
+
+    error = None
+
+    def showtraceback(self):
+        self._recordError()
+        super(ReplayConsole, self).showtraceback()
+
+    def showsyntaxerror(self, filename=None, **kwargs):
+        self._recordError()
+        super(ReplayConsole, self).showsyntaxerror(filename, **kwargs)
+
+    def _recordError(self):
+        etype, value = sys.exc_info()[:2]
+        if etype is None:
+            self.error = "Unknown error"
+        else:
+            self.error = "%s: %s" % (etype.__name__, value)
+
+
+class ReplaySettings(object):
+
+    """
+    A stand-in for the RoboREPL settings. Values that are
+    set can be read back, everything else is a method that
+    does nothing.
+    """
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self._ignore
+
+    def _ignore(self, *args, **kwargs):
+        return None
+
+
+class CountingOutput(object):
+
+    """
+    A stream that counts the characters written to it.
+    """
+
+    softspace = 0
+
+    def __init__(self):
+        self.characterCount = 0
+
+    def write(self, s):
+        self.characterCount += len(s)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def replayRecording(recording, fontPaths=None):
+    """
+    Execute the commands in recording in a new namespace.
+    Returns a list with the (seconds, outputLength, error) of
+    every command and the startup code error. error is None
+    or the last exception the command raised. If fontPaths is
+    None, the recorded fonts are opened.
+    """
+    if fontPaths is None:
+        fontPaths = recording.get("fonts", [])
+    maxItems, maxDepth, maxLength = recording.get("resultLimits", (100, 4, 10000))
+    historyLimits = tuple(recording.get("historyLimits", defaultHistoryLimits))
+    fonts = ReplayFonts(fontPaths)
+    namespace = fonts.namespace()
+    namespace["settings"] = ReplaySettings()
+    resultHistory = ResultHistory(namespace, lambda: historyLimits)
+    displayHook = DisplayHook(namespace, lambda: LimitedRepr(maxItems, maxDepth, maxLength), resultHistory)
+    namespace["Out"] = resultHistory
+    namespace["more"] = displayHook.more
+    namespace["show"] = displayHook.show
+    output = CountingOutput()
+    save = (sys.stdout, sys.stderr, sys.displayhook)
+    sys.stdout = sys.stderr = output
+    sys.displayhook = displayHook
+    console = ReplayConsole(locals=namespace)
+    results = []
+    startupError = None
+    try:
+        startupCode = recording.get("startupCode")
+        if startupCode:
+            try:
+                exec(compile(startupCode, "", "exec", 0), namespace)
+            except Exception as e:
+                # the output is only counted, show this on the real stderr
+                print("The startup code failed:", file=save[1])
+                traceback.print_exc(file=save[1])
+                startupError = "%s: %s" % (e.__class__.__name__, e)
+        for command in recording["commands"]:
+            outputStart = output.characterCount
+            seconds = 0
+            console.error = None
+            for line in command["source"].split("\n"):
+                start = time.perf_counter()
+                console.push(line)
+                seconds += time.perf_counter() - start
+            console.resetbuffer()
+            results.append((seconds, output.characterCount - outputStart, console.error))
+    finally:
+        sys.stdout, sys.stderr, sys.displayhook = save
+        closeEventLoop(console.loop)
+    return results, startupError
+
+
+def formatDelta(recorded, replayed):
+    if recorded <= 0:
+        return "n/a"
+    return "%+.1f%%" % ((replayed - recorded) / recorded * 100)
+
+
+def printReport(recording, results, out=None, startupError=None):
+    """
+    Print the recorded and replayed time of every command.
+    Returns the total change in percent. Failed commands
+    are left out of the total.
+    """
+    if out is None:
+        out = sys.stdout
+    print("Recorded %s with Python %s on %s." % (recording.get("created"), recording.get("python"), recording.get("platform")), file=out)
+    print("Replayed with Python %s on %s." % (platform.python_version(), platform.platform()), file=out)
+    if startupError is not None:
+        print("The startup code failed, commands may fail or run differently: %s" % startupError, file=out)
+    print("", file=out)
+    print("%4s  %11s  %11s  %8s  %17s  %s" % ("#", "recorded", "replayed", "delta", "output", "source"), file=out)
+    recordedTotal = replayedTotal = 0
+    failures = []
+    for index, (command, (seconds, outputLength, error)) in enumerate(zip(recording["commands"], results)):
+        recordedSeconds = command["seconds"]
+        if error is None:
+            recordedTotal += recordedSeconds
+            replayedTotal += seconds
+            delta = formatDelta(recordedSeconds, seconds)
+        else:
+            failures.append((index + 1, error))
+            delta = "FAILED"
+        if outputLength == command["outputLength"]:
+            outputText = "%d" % outputLength
+        else:
+            outputText = "%d -> %d" % (command["outputLength"], outputLength)
+        source = command["source"].strip().split("\n")[0]
+        if len(source) > 40:
+            source = source[:39] + "…"
+        print("%4d  %8.2f ms  %8.2f ms  %8s  %17s  %s" % (
+            index + 1,
+            recordedSeconds * 1000,
+            seconds * 1000,
+            delta,
+            outputText,
+            source
+        ), file=out)
+    print("%4s  %8.2f ms  %8.2f ms  %8s" % ("all", recordedTotal * 1000, replayedTotal * 1000, formatDelta(recordedTotal, replayedTotal)), file=out)
+    if failures:
+        print("", file=out)
+        print("%d commands failed and are not part of the total:" % len(failures), file=out)
+        for number, error in failures:
+            print("%4d  %s" % (number, error), file=out)
+    if recordedTotal <= 0:
+        return 0
+    return (replayedTotal - recordedTotal) / recordedTotal * 100
+
+
+def combineResults(a, b):
+    """
+    Combine the results of one command from two replays:
+    the fastest time and the error, if either failed.
+    """
+    error = a[2] or b[2]
+    fastest = min(a, b, key=lambda result: result[0])
+    return fastest[0], fastest[1], error
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Replay a RoboREPL recording and compare the timings.")
+    parser.add_argument("recording", help="The recording (.json) to replay.")
+    parser.add_argument("--font", action="append", dest="fonts", metavar="path", help="A UFO to open instead of the recorded fonts. Can be given more than once. The first is the current font.")
+    parser.add_argument("--repeat", type=int, default=1, metavar="n", help="Replay n times and use the fastest time of every command.")
+    parser.add_argument("--threshold", type=float, default=None, metavar="percent", help="Exit with status 1 when the total time is more than percent slower than recorded.")
+    args = parser.parse_args(args)
+    try:
+        recording = loadRecording(args.recording)
+    except RecordingError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    best = None
+    startupError = None
+    for i in range(max(1, args.repeat)):
+        results, error = replayRecording(recording, args.fonts)
+        startupError = startupError or error
+        if best is None:
+            best = results
+        else:
+            best = [combineResults(a, b) for a, b in zip(best, results)]
+    change = printReport(recording, best, startupError=startupError)
+    if args.threshold is not None and change > args.threshold:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Double-click selection of Python tokens.
+
+Instead of walking away from the clicked character one
+character at a time, a bounded fragment around the click
+is taken from the text storage in one call and the line
+containing the click is scanned with a single compiled
+pattern. Only the fragment is copied into Python, so the
+cost depends on the fragment size, not on the size of the
+text, which can be a very long transcript.
+
+Double-clicking selects:
+
+- a name
+- a whole dotted name, when the click is on one of its dots
+- a whole string literal, when the click is on its prefix or quotes
+- a whole number, including its sign-less exponent and suffix
+
+Everything else is left to the default word selection.
+
+Run this file to see the timing for growing transcript sizes.
+With AppKit available, the timing uses a real NSTextStorage
+and includes the PyObjC bridge. Without it, a pure Python
+stand-in is used, which only times the scanning.
+"""
+
+import re
+
+selectionRadius = 1000
+
+namePattern = r"[^\W\d]\w*"
+tokenRE = re.compile(
+    r"(?P<string>[rRbBuUfF]{0,2}(?:"
+        r"'''(?:[^\\]|\\.)*?'''"
+        r"|\"\"\"(?:[^\\]|\\.)*?\"\"\""
+        r"|'(?:[^'\\\n]|\\.)*'"
+        r"|\"(?:[^\"\\\n]|\\.)*\""
+    r"))"
+    r"|(?P<number>"
+        r"0[xXoObB][0-9a-fA-F_]+"
+        r"|(?:\d[\d_]*(?:\.[\d_]*)?|\.\d[\d_]*)(?:[eE][+-]?\d[\d_]*)?[jJ]?"
+    r")"
+    r"|(?P<name>" + namePattern + r"(?:\." + namePattern + r")*)"
+)
+nameRE = re.compile(namePattern)
+
+
+def findTokenRange(text, index):
+    """
+    Get the (start, length) of the token at index in text
+    or None if there is no token there. index and the
+    result are in UTF-16 code units, like NSString ranges.
+    """
+    if text.isascii():
+        return _findTokenRange(text, index)
+    offsets = utf16Offsets(text)
+    codePointIndex = _codePointIndex(offsets, index)
+    found = _findTokenRange(text, codePointIndex)
+    if found is None:
+        return None
+    start, length = found
+    start16 = offsets[start]
+    return start16, offsets[start + length] - start16
+
+
+def findTokenRangeInTextStorage(textStorage, location, radius=selectionRadius):
+    """
+    Get the (start, length) of the token at location in
+    textStorage, an NSTextStorage or anything else with
+    length and attributedSubstringFromRange_ methods. Only
+    a fragment of radius code units on either side of
+    location is looked at.
+    """
+    start = max(0, location - radius)
+    end = min(textStorage.length(), location + radius + 1)
+    if end <= start:
+        return None
+    fragment = textStorage.attributedSubstringFromRange_((start, end - start)).string()
+    found = findTokenRange(fragment, location - start)
+    if found is None:
+        return None
+    return start + found[0], found[1]
+
+
+def _findTokenRange(text, index):
+    if index < 0 or index > len(text):
+        return None
+    lineStart = text.rfind("\n", 0, index) + 1
+    lineEnd = text.find("\n", index)
+    if lineEnd == -1:
+        lineEnd = len(text)
+    # a click right after a token at the end of a line
+    # is still a click on that token
+    candidates = [index]
+    if index == lineEnd and index > lineStart:
+        candidates.append(index - 1)
+    for candidate in candidates:
+        for match in tokenRE.finditer(text, lineStart, lineEnd):
+            start, end = match.span()
+            if start > candidate:
+                break
+            if candidate >= end:
+                continue
+            if match.lastgroup == "string":
+                found = _findStringRange(match, candidate)
+            elif match.lastgroup == "name":
+                found = _findNameRange(match, candidate)
+            else:
+                found = (start, end - start)
+            if found is not None:
+                return found
+            return None
+    return None
+
+
+def _findStringRange(match, index):
+    start, end = match.span()
+    body = match.group().lstrip("rRbBuUfF")
+    bodyStart = end - len(body)
+    if body[:3] in ("'''", '"""') and len(body) >= 6:
+        quoteLength = 3
+    else:
+        quoteLength = 1
+    if index < bodyStart + quoteLength or index >= end - quoteLength:
+        return start, end - start
+    # inside the string, select the word like normal text
+    for wordMatch in nameRE.finditer(match.string, bodyStart + quoteLength, end - quoteLength):
+        wordStart, wordEnd = wordMatch.span()
+        if wordStart <= index < wordEnd:
+            return wordStart, wordEnd - wordStart
+    return None
+
+
+def _findNameRange(match, index):
+    start, end = match.span()
+    text = match.string
+    if text[index] == ".":
+        return start, end - start
+    for nameMatch in nameRE.finditer(text, start, end):
+        nameStart, nameEnd = nameMatch.span()
+        if nameStart <= index < nameEnd:
+            return nameStart, nameEnd - nameStart
+    return None
+
+
+def utf16Offsets(text):
+    """
+    Get the UTF-16 offset of every code point in text,
+    plus the offset of the end of text.
+    """
+    offsets = [0]
+    offset = 0
+    for character in text:
+        if ord(character) > 0xFFFF:
+            offset += 2
+        else:
+            offset += 1
+        offsets.append(offset)
+    return offsets
+
+
+def _codePointIndex(offsets, index):
+    # offsets is sorted, find the code point starting at or before index
+    low = 0
+    high = len(offsets) - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if offsets[middle] <= index:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+# ---------
+# Benchmark
+# ---------
+
+class _BenchmarkTextStorage(object):
+
+    """
+    A stand-in for NSTextStorage. It doesn't go through
+    the PyObjC bridge, so it only times the scanning.
+    """
+
+    def __init__(self, text):
+        self._text = text
+
+    def length(self):
+        return len(self._text)
+
+    def attributedSubstringFromRange_(self, aRange):
+        location, length = aRange
+        return _BenchmarkTextStorage(self._text[location:location + length])
+
+    def string(self):
+        return self._text
+
+
+def _makeBenchmarkTextStorage(text):
+    try:
+        import AppKit
+    except ImportError:
+        return _BenchmarkTextStorage(text)
+    return AppKit.NSTextStorage.alloc().initWithString_(text)
+
+
+def _benchmark():
+    import timeit
+    line = "font = CurrentFont(); glyph = font[\"a\"]; print(glyph.width, 12.5e3, font.info.familyName)\n"
+    if isinstance(_makeBenchmarkTextStorage(""), _BenchmarkTextStorage):
+        print("AppKit is not available, the PyObjC bridge is not part of these timings.")
+    else:
+        print("Timing with NSTextStorage.")
+    print("%12s  %10s  %s" % ("text length", "per click", "selection"))
+    for size in (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7):
+        text = (line * (size // len(line) + 1))[:size] + line
+        textStorage = _makeBenchmarkTextStorage(text)
+        location = len(text) - len(line) + line.index("info")
+        number = 2000
+        seconds = timeit.timeit(lambda: findTokenRangeInTextStorage(textStorage, location), number=number)
+        start, length = findTokenRangeInTextStorage(textStorage, location)
+        print("%12d  %8.2fus  %r" % (len(text), seconds / number * 1000000, text[start:start + length]))
+
+
+if __name__ == "__main__":
+    _benchmark()
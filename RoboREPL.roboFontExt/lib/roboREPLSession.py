@@ -0,0 +1,280 @@
+"""
+Namespace snapshots.
+
+A session file holds the picklable part of a namespace.
+Each value is pickled separately with pickle protocol 5
+so that one unpicklable value doesn't spoil the rest.
+Large buffers (NumPy arrays and anything else that
+supports out-of-band pickling, and large bytes, bytearray
+and memoryview values) are written as raw blocks next to
+the pickles. When the session is loaded, the file is memory
+mapped and those blocks are handed back without copying.
+The exceptions are bytes and bytearray values, which have
+to own their memory and are copied out of the mapping.
+
+Because every value is pickled on its own, objects shared
+between names are not shared after loading. After p = q = [],
+p and q are two separate lists when the session is loaded.
+Names like that are listed in the report.
+
+File layout:
+
+- magic, format version
+- blocks, each aligned to blockAlignment
+- index (JSON)
+- index offset, index length, magic
+"""
+
+import os
+import json
+import time
+import mmap
+import struct
+import pickle
+import importlib
+import types
+from roboREPLMemory import formatByteSize
+
+sessionFileExtension = ".roboREPLSession"
+magic = b"RREPLSES"
+formatVersion = 1
+headerFormat = "<8sI4x"
+footerFormat = "<QQ8s"
+blockAlignment = 64
+outOfBandThreshold = 64 * 1024
+rawBufferTypes = (bytes, bytearray, memoryview)
+immutableTypes = (
+    int, float, complex, bool, str, bytes, type(None),
+    range, slice, type(Ellipsis), type(NotImplemented)
+)
+
+
+class SessionError(Exception): pass
+
+
+class SessionReport(object):
+
+    def __init__(self):
+        self.names = []
+        self.modules = []
+        self.skipped = {}
+        # name : the earlier name holding the same object
+        self.copies = {}
+        self.fileSize = 0
+        self.outOfBandSize = 0
+        self.duration = 0
+
+    def printReport(self, verb):
+        print("%s %d values and %d modules in %.3f seconds. File size: %s (%s out-of-band)." % (
+            verb,
+            len(self.names),
+            len(self.modules),
+            self.duration,
+            formatByteSize(self.fileSize),
+            formatByteSize(self.outOfBandSize)
+        ))
+        if self.skipped:
+            print("Skipped %d names:" % len(self.skipped))
+            for name, reason in sorted(self.skipped.items()):
+                print("  %s : %s" % (name, reason))
+        if self.copies:
+            print("These names referred to the same object when saved and are separate copies when loaded:")
+            for name, other in sorted(self.copies.items()):
+                print("  %s is a copy of %s" % (name, other))
+
+
+# ----
+# Save
+# ----
+
+class _BlockWriter(object):
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, data):
+        f = self.f
+        offset = f.tell()
+        padding = -offset % blockAlignment
+        if padding:
+            f.write(b"\0" * padding)
+            offset += padding
+        f.write(data)
+        return offset, f.tell() - offset
+
+
+def saveSession(path, namespace, names):
+    """
+    Write the values for names in namespace to path.
+    Returns a SessionReport.
+    """
+    report = SessionReport()
+    start = time.perf_counter()
+    entries = []
+    tempPath = path + ".tmp"
+    with open(tempPath, "wb") as f:
+        f.write(struct.pack(headerFormat, magic, formatVersion))
+        writer = _BlockWriter(f)
+        # id : first name
+        savedObjects = {}
+        for name in names:
+            value = namespace[name]
+            if isinstance(value, types.ModuleType):
+                entries.append(dict(name=name, kind="module", module=value.__name__))
+                report.modules.append(name)
+                continue
+            if not _isImmutable(value):
+                other = savedObjects.setdefault(id(value), name)
+                if other != name:
+                    report.copies[name] = other
+            if type(value) in rawBufferTypes:
+                view = _getRawView(value)
+                if view is not None and view.nbytes >= outOfBandThreshold:
+                    offset, length = writer.write(view.cast("B"))
+                    entry = dict(name=name, kind=type(value).__name__, offset=offset, length=length)
+                    if isinstance(value, memoryview):
+                        entry["format"] = view.format
+                        entry["shape"] = list(view.shape)
+                        entry["itemsize"] = view.itemsize
+                    if name in report.copies:
+                        entry["copyOf"] = report.copies[name]
+                    entries.append(entry)
+                    report.names.append(name)
+                    report.outOfBandSize += length
+                    continue
+            buffers = []
+            def bufferCallback(buffer):
+                try:
+                    raw = buffer.raw()
+                except BufferError:
+                    return True
+                if raw.nbytes < outOfBandThreshold:
+                    return True
+                buffers.append(raw)
+                return False
+            try:
+                data = pickle.dumps(value, protocol=5, buffer_callback=bufferCallback)
+            except Exception as e:
+                report.skipped[name] = "%s: %s" % (e.__class__.__name__, e)
+                continue
+            offset, length = writer.write(data)
+            entry = dict(name=name, kind="pickle", offset=offset, length=length, buffers=[])
+            if name in report.copies:
+                entry["copyOf"] = report.copies[name]
+            for raw in buffers:
+                entry["buffers"].append(writer.write(raw))
+                report.outOfBandSize += raw.nbytes
+            entries.append(entry)
+            report.names.append(name)
+        index = dict(version=formatVersion, created=time.time(), entries=entries)
+        indexData = json.dumps(index).encode("utf-8")
+        indexOffset, indexLength = writer.write(indexData)
+        f.write(struct.pack(footerFormat, indexOffset, indexLength, magic))
+        report.fileSize = f.tell()
+    os.replace(tempPath, path)
+    report.duration = time.perf_counter() - start
+    return report
+
+
+def _isImmutable(value):
+    """
+    Values that can't change don't need to stay the same
+    object, and small ints, None and interned strings are
+    shared between names anyway.
+    """
+    typ = type(value)
+    if typ in immutableTypes:
+        return True
+    if typ is tuple or typ is frozenset:
+        return all(_isImmutable(item) for item in value)
+    return False
+
+
+def _getRawView(value):
+    """
+    Get a memoryview of value that can be written as raw
+    bytes and turned back into the same view when loading,
+    or None if that isn't possible.
+    """
+    try:
+        view = memoryview(value)
+        raw = view.cast("B")
+        # make sure the format and shape can be restored
+        raw.cast(view.format, view.shape)
+    except (TypeError, ValueError):
+        return None
+    return view
+
+
+# ----
+# Load
+# ----
+
+def loadSession(path):
+    """
+    Read the values stored in path.
+    Returns a dict of values and a SessionReport.
+    """
+    report = SessionReport()
+    start = time.perf_counter()
+    headerSize = struct.calcsize(headerFormat)
+    footerSize = struct.calcsize(footerFormat)
+    with open(path, "rb") as f:
+        # an empty file can't be mapped
+        if os.fstat(f.fileno()).st_size < headerSize + footerSize:
+            raise SessionError("%s is not a RoboREPL session file." % path)
+        # ACCESS_COPY gives a private, writable mapping so
+        # that arrays built on it can be modified without
+        # touching the file. Pages are only read on demand.
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    view = memoryview(data)
+    try:
+        fileMagic, version = struct.unpack_from(headerFormat, data, 0)
+        indexOffset, indexLength, footerMagic = struct.unpack_from(footerFormat, data, len(data) - footerSize)
+        if fileMagic != magic or footerMagic != magic:
+            raise SessionError("%s is not a RoboREPL session file." % path)
+        if version > formatVersion:
+            raise SessionError("%s was written by a newer version of RoboREPL." % path)
+        try:
+            index = json.loads(bytes(view[indexOffset:indexOffset + indexLength]).decode("utf-8"))
+        except ValueError:
+            raise SessionError("The index of %s is damaged." % path)
+    except:
+        view.release()
+        data.close()
+        raise
+    values = {}
+    for entry in index["entries"]:
+        name = entry["name"]
+        kind = entry["kind"]
+        try:
+            if kind == "module":
+                values[name] = importlib.import_module(entry["module"])
+                report.modules.append(name)
+                continue
+            block = view[entry["offset"]:entry["offset"] + entry["length"]]
+            if kind == "pickle":
+                buffers = [view[offset:offset + length] for offset, length in entry["buffers"]]
+                value = pickle.loads(block, buffers=buffers)
+                report.outOfBandSize += sum(length for offset, length in entry["buffers"])
+            elif kind == "memoryview":
+                value = block.cast(entry["format"], entry["shape"])
+                report.outOfBandSize += entry["length"]
+            elif kind == "bytes":
+                value = bytes(block)
+                report.outOfBandSize += entry["length"]
+            elif kind == "bytearray":
+                value = bytearray(block)
+                report.outOfBandSize += entry["length"]
+            else:
+                raise SessionError("Unknown entry kind %r." % kind)
+        except Exception as e:
+            report.skipped[name] = "%s: %s" % (e.__class__.__name__, e)
+            continue
+        values[name] = value
+        report.names.append(name)
+        if "copyOf" in entry:
+            report.copies[name] = entry["copyOf"]
+    report.fileSize = len(data)
+    report.duration = time.perf_counter() - start
+    return values, report
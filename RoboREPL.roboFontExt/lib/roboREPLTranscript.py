@@ -0,0 +1,149 @@
+"""
+Session transcripts.
+
+TranscriptWriter records prompts, code and output in a
+log file. Writing to it only appends to an in-memory queue,
+so it never waits for the disk. A background thread collects
+everything queued since its last pass and appends it to the
+file in one write. When the file grows past a size limit, it
+is rotated: path becomes path.1, path.1 becomes path.2 and
+so on.
+
+With compression turned on, each batch is appended as a
+separate gzip member. The result is a valid gzip file at any
+point, even if RoboFont quits in the middle of a session.
+"""
+
+import os
+import time
+import gzip
+import threading
+from collections import deque
+
+
+class TranscriptWriter(object):
+
+    """
+    - path : The log file path.
+    - maxBytes : The file size at which the file is rotated. 0 means never.
+    - backupCount : The number of rotated files to keep.
+    - compress : Write gzip compressed data.
+    - maxPending : The number of segments that may be waiting to be
+      written. If the disk can't keep up, further segments are
+      dropped and the number of dropped segments is recorded.
+    - flushInterval : The number of seconds between writes.
+    - previous : A closed writer that may still be writing. Nothing
+      is written until it has finished, since it may be writing
+      to the same file.
+    """
+
+    def __init__(self, path, maxBytes=10 * 1024 * 1024, backupCount=5, compress=False, maxPending=100000, flushInterval=0.5, previous=None):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.compress = compress
+        self.maxPending = maxPending
+        self.flushInterval = flushInterval
+        self.dropped = 0
+        self.errors = 0
+        self._pending = deque()
+        self._lastSource = None
+        self._previous = previous
+        self._stopEvent = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="RoboREPL Transcript")
+        self._thread.daemon = True
+        self._thread.start()
+
+    # Queue
+
+    def write(self, source, kind, text):
+        """
+        Queue text for writing. kind is "code", "stdout" or
+        "stderr". source identifies where the text came from,
+        such as a window. This never blocks.
+        """
+        if len(self._pending) >= self.maxPending:
+            self.dropped += 1
+            return
+        self._pending.append((source, kind, text))
+
+    def close(self, wait=True):
+        """
+        Write everything that is pending and stop the thread.
+        If wait is False, this returns without waiting for
+        the final write to finish.
+        """
+        self._stopEvent.set()
+        if wait:
+            self._thread.join()
+
+    # Writing
+
+    def _run(self):
+        if self._previous is not None:
+            self._previous._thread.join()
+            self._previous = None
+        while not self._stopEvent.wait(self.flushInterval):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        pending = self._pending
+        if not pending and not self.dropped:
+            return
+        segments = []
+        popleft = pending.popleft
+        while True:
+            try:
+                segments.append(popleft())
+            except IndexError:
+                break
+        dropped = self.dropped
+        self.dropped = 0
+        data, lastSource = self._encode(segments, dropped, self._lastSource)
+        try:
+            if self._rotateIfNeeded(len(data)):
+                # the new file has to start with a header
+                data, lastSource = self._encode(segments, dropped, None)
+            with open(self.path, "ab") as f:
+                f.write(data)
+        except OSError:
+            self.errors += 1
+        self._lastSource = lastSource
+
+    def _encode(self, segments, dropped, lastSource):
+        pieces = []
+        for source, kind, text in segments:
+            if source != lastSource:
+                lastSource = source
+                pieces.append("\n--- %s %s ---\n" % (source, time.strftime("%Y-%m-%d %H:%M:%S")))
+            pieces.append(text)
+        if dropped:
+            pieces.append("\n--- %d segments were dropped because the disk could not keep up ---\n" % dropped)
+        data = "".join(pieces).encode("utf-8")
+        if self.compress:
+            data = gzip.compress(data)
+        return data, lastSource
+
+    def _rotateIfNeeded(self, incoming):
+        """
+        Rotate the file if incoming bytes would make it too
+        big. Returns True if the file was rotated.
+        """
+        if not self.maxBytes:
+            return False
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return False
+        if size + incoming <= self.maxBytes:
+            return False
+        if self.backupCount <= 0:
+            os.remove(self.path)
+            return True
+        for index in range(self.backupCount - 1, 0, -1):
+            source = "%s.%d" % (self.path, index)
+            if os.path.exists(source):
+                os.replace(source, "%s.%d" % (self.path, index + 1))
+        os.replace(self.path, self.path + ".1")
+        return True